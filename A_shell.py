@@ -11,7 +11,7 @@ alt = np.pi/2 - theta
 
 J = sf.stokes.create_J(az=az, alt=alt)
 
-A = np.array([sf.stokes.create_A(J=Ji) for Ji in J])
+A = sf.stokes.create_A(J=J)
 
 def project_A(A, func):
     def orth(i, j, panel, ttl=None):
@@ -12,8 +12,10 @@ def probe_stokes_params(fname, rAnt1=None, rAnt2=None):
     """
     out of context
     """
+    if not sf.store.is_store(fname):
+        fname += ".pickle"
     fcd, fs, ts, ptitle = load_wedge_sim(
-        fname + ".pickle", rAnt1, rAnt2
+        fname, rAnt1, rAnt2
     )
     
     print("Simulation file loaded.\n")
@@ -29,111 +31,73 @@ def load_wedge_sim(fname, rAnt1, rAnt2, tGoal=None):
     """
     out of context
     """
-    sim_file = open(fname, "rb")
-
-    meta = pickle.load(sim_file)
-
-    ptitle = meta['title']
-
-    fs = meta['frequencies']
-    #print(fs)
-    
-    num_f = len(fs)
-    
-    ts = meta['times']
-    num_t = len(ts)
-    
-    sim = meta['picture']
-    
-    fcd = {} # fourier candidate dictionary
+    if sf.store.is_store(fname):
+        # only the requested baselines are read from a chunked store
+        source = sf.store.open_store(fname)
+        ptitle = source.title
+        pairs = source.baselines
+    else:
+        with open(fname, "rb") as sim_file:
+            meta = pickle.load(sim_file)
+        ptitle = meta['title']
+        source = sf.wedge.unpackage(meta)
+        pairs = source.pairs
+
+    keep = np.ones(len(pairs), dtype=bool)
+    if rAnt1 is not None:
+        keep &= pairs[:, 0] == rAnt1
+    if rAnt2 is not None:
+        keep &= pairs[:, 1] == rAnt2
+    fcd = source.select(pairs[keep])
+
+    if sf.store.is_store(fname):
+        source.close()
+
+    fs = fcd.frequencies
+    ts = fcd.times
     
     max_counts = [0, 0, 0, 0]
     
-    for ant1 in sim.keys():
-        fcd[ant1] = {}
-        for ant2 in sim[ant1].keys():
-            # 0: I    1: Q    2: U    3: V
-            if rAnt1 is not None and rAnt1 != ant1:
+    for b, (ant1, ant2) in enumerate(fcd.pairs.tolist()):
+        for ti in range(len(ts)):
+            if tGoal is None or tGoal != np.around(ts[ti], 4):
                 continue
-            if rAnt2 is not None and rAnt2 != ant2:
-                continue
-            
-            fourierc = [[], [], [], []]
             
-            for ti in range(num_t):
-                if tGoal is None or tGoal != np.around(ts[ti], 4):
-                    continue
-                
-                for parameter in fourierc:
-                    parameter.append([])
-                
-                for ni in range(num_f):
-                    v = sim[ant1][ant2][ni][ti]
-
-                    v_test = np.array([
-                        np.abs(S) for S in v
-                    ])
-                    
-                    for i in range(len(v_test)):
-                        if v_test[i] == v_test.max():
-                           max_counts[i] += 1 
-
-                    for p_idx in range(len(fourierc)):
-                        fourierc[p_idx][ti].append(v[p_idx])
-                
-                # si: Stokes index
-                for si in range(len(fourierc)):
-                    parameter = fourierc[si]
-                    parameter[ti] = np.array(parameter[ti])
-                    
-                    # cut the next three statements
-                    # in case you no longer want to plot this
-                    plt.plot(fs / 1e6,
-                        np.abs(parameter[len(parameter) - 1]),
-                        label=str(ad_hoc_labels[si]),
-                        color=ad_hoc_colors[si])
-        
-                plt.legend(loc='upper right')
-                plt.title(
-                    "Raw Visibilities (LST = " + \
-                    str(np.around(ts[ti], 4)) + \
-                    "). Antennae: " + \
-                    str(ant1) + " to " + \
-                    str(ant2)
-                )
-                plt.xlabel("Frequency [MHz]")
-                plt.ylabel("Brightness Magnitude [Jy]")
-                plt.show()
-        
-            for parameter in fourierc:
-                parameter = np.array(parameter)
+            # N_nu x 4
+            v = fcd.data[b, :, ti]
 
-            fcd[ant1][ant2] = np.array(fourierc)
+            # which Stokes parameter dominates at each frequency
+            dominant = np.argmax(np.abs(v), axis=1)
+            for i in range(4):
+                max_counts[i] += np.count_nonzero(dominant == i)
+            
+            # si: Stokes index
+            for si in range(4):
+                # cut the next three statements
+                # in case you no longer want to plot this
+                plt.plot(fs / 1e6,
+                    np.abs(v[:, si]),
+                    label=str(ad_hoc_labels[si]),
+                    color=ad_hoc_colors[si])
+    
+            plt.legend(loc='upper right')
+            plt.title(
+                "Raw Visibilities (LST = " + \
+                str(np.around(ts[ti], 4)) + \
+                "). Antennae: " + \
+                str(ant1) + " to " + \
+                str(ant2)
+            )
+            plt.xlabel("Frequency [MHz]")
+            plt.ylabel("Brightness Magnitude [Jy]")
+            plt.show()
 
     print(max_counts)
 
     return fcd, fs, ts, ptitle    
        
 def transform_wedge(original, fs, ts):
-    num_f = len(fs)
-    num_t = len(ts)
-    
-    import copy
-    
-    fourier_dict = copy.deepcopy(original)
-
-    window = pol.genWindow(num_f)
-
-    for ant1 in fourier_dict.keys():
-        for ant2 in fourier_dict[ant1].keys():
-            fourier = fourier_dict[ant1][ant2]
-            for ti in range(num_t):
-                for parameter in fourier:
-                    parameter[ti] = np.fft.fft(
-                        parameter[ti] * window
-                    )
-                
-    return fourier_dict
+    return original.transform(pol.genWindow(len(fs)))
 
 def collect_wedge_points(fcd, fs, ts, rAnt1, rAnt2):
     """
@@ -155,58 +119,57 @@ def collect_wedge_points(fcd, fs, ts, rAnt1, rAnt2):
     max_counts = [0, 0, 0, 0]
     hmax_counts = [0, 0, 0, 0]
 
-    for ant1 in fcd.keys():
-        for ant2 in fcd[ant1].keys():
-        
-            if rAnt1 is not None and rAnt1 != ant1:
-                continue
-            if rAnt2 is not None and rAnt2 != ant2:
-                continue
+    for b, (ant1, ant2) in enumerate(fcd.pairs.tolist()):
+    
+        if rAnt1 is not None and rAnt1 != ant1:
+            continue
+        if rAnt2 is not None and rAnt2 != ant2:
+            continue
+    
+        baselength = sf.ant.baselength(ant1, ant2)
         
-            baselength = sf.ant.baselength(ant1, ant2)
+        for nu_idx in range(num_f):
+            
+            nua = np.average(fs)
+            nu = fs[nu_idx]
+            
+            z = pol.fq2z(nu / 1e9)
+            
+            lambda_ = pol.C / nu
             
-            for nu_idx in range(num_f):
+            k_perp = baselength * pol.k_perp(z) / lambda_
+            
+            for t_idx in range(num_t - 1):
+                this_instant = \
+                    fcd.data[b, nu_idx, t_idx]
+                
+                # [I1, Q1, U1, V1] * [I2*, Q2*, U2*, V2*]
+                
+                this_test = np.array([
+                    np.abs(S) for S in this_instant
+                ])
                 
-                nua = np.average(fs)
-                nu = fs[nu_idx]
+                for i in range(len(this_test)):
+                    if this_test[i] == this_test.max():
+                       max_counts[i] += 1 
+                       
+                next_instant = \
+                    fcd.data[b, nu_idx, t_idx + 1]
                 
-                z = pol.fq2z(nu / 1e9)
+                # [I1, Q1, U1, V1] * [I2*, Q2*, U2*, V2*]
+                
+                hadamard = np.multiply(
+                    this_instant, next_instant
+                )
                 
-                lambda_ = pol.C / nu
+                htest = np.array([
+                    np.abs(S) for S in hadamard
+                ])
                 
-                k_perp = baselength * pol.k_perp(z) / lambda_
+                for i in range(len(htest)):
+                    if htest[i] == htest.max():
+                       hmax_counts[i] += 1
                 
-                for t_idx in range(num_t - 1):
-                    this_instant = \
-                        fcd[ant1][ant2][:, t_idx, nu_idx]
-                    
-                    # [I1, Q1, U1, V1] * [I2*, Q2*, U2*, V2*]
-                    
-                    this_test = np.array([
-                        np.abs(S) for S in this_instant
-                    ])
-                    
-                    for i in range(len(this_test)):
-                        if this_test[i] == this_test.max():
-                           max_counts[i] += 1 
-                           
-                    next_instant = \
-                        fcd[ant1][ant2][:, t_idx + 1, nu_idx]
-                    
-                    # [I1, Q1, U1, V1] * [I2*, Q2*, U2*, V2*]
-                    
-                    hadamard = np.multiply(
-                        this_instant, next_instant
-                    )
-                    
-                    htest = np.array([
-                        np.abs(S) for S in hadamard
-                    ])
-                    
-                    for i in range(len(htest)):
-                        if htest[i] == htest.max():
-                           hmax_counts[i] += 1
-                    
     print(max_counts)
     print(hmax_counts)
     
@@ -8,15 +8,17 @@
 import matplotlib.pyplot as plt
 import numpy as np
 
+import skyflux as sf
+
 import pickle
 picture_file = open("67_src_wedge.pickle", "rb")
 meta = pickle.load(picture_file)
-pic = meta['picture']
+# handles both the array format and the older nested dictionaries
+pic = sf.wedge.unpackage(meta)
 
-for ant1 in pic.keys():
-    for ant2 in pic[ant1].keys():
-        for nu_idx in range(len(pic[ant1][ant2])):
-            next_plot = np.array(pic[ant1][ant2][nu_idx])
-            plt.plot(np.abs(next_plot[:, 0]))
-            plt.show()
+for b in range(len(pic)):
+    for nu_idx in range(len(pic.frequencies)):
+        next_plot = pic.data[b, nu_idx]
+        plt.plot(np.abs(next_plot[:, 0]))
+        plt.show()
 
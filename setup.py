@@ -34,10 +34,18 @@ setup(
     packages=find_packages(),
     package_data={'': [
         'catalog.npy',
+        'catalog_table.npy',
         'ant_dict.pk',
-        'sbf_params.npy'
+        'ant_layout.npz',
+        'sbf_params.npy',
+        'sbf_params/*.npy'
     ]},
     include_package_data=True,
     # until RIMEz updates its numba references:
     install_requires=[''], #I definitely need to come back and fix this
+    # chunked visibility stores (skyflux.store)
+    extras_require={
+        'hdf5': ['h5py'],
+        'zarr': ['zarr'],
+    },
 )
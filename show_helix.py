@@ -41,9 +41,16 @@ def hauto_show(fname, pt_override=None):
     return visual, fouriered, fs, ts, raw_vis
 
 def build_fourier_candidates(fname):
-    sim_file = open(fname + ".pickle", "rb")
-    
-    meta = pickle.load(sim_file)
+    if sf.store.is_store(fname):
+        # a helix is a single-baseline store
+        with sf.store.open_store(fname) as source:
+            meta = {'title' : source.title,
+                    'frequencies' : source.frequencies,
+                    'times' : source.times,
+                    'picture' : source.visibilities[0]}
+    else:
+        sim_file = open(fname + ".pickle", "rb")
+        meta = pickle.load(sim_file)
     
     ptitle = meta['title']
     
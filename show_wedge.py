@@ -33,7 +33,7 @@ def ppp(pp, key, power=1):
     plt.show()
 
 def power_parameters(fname, ant1, ant2):
-    fcd, fs, ts, ptitle = load_wedge_sim(fname + ".pickle")
+    fcd, fs, ts, ptitle = load_wedge_sim(sim_path(fname))
 
     print("Simulation file loaded.\n")
 
@@ -115,7 +115,7 @@ def wauto_show(fname, sp=None, pt_override=None, static=False, Qi=None, special_
         (ant1, ant2) tuple, in case you want to look at a
         k_orth cross-section
     """
-    fcd, fs, ts, ptitle = load_wedge_sim(fname + ".pickle")
+    fcd, fs, ts, ptitle = load_wedge_sim(sim_path(fname))
     
     if Qi is None:
         # hard coding for four Stokes param.s
@@ -142,96 +142,59 @@ def wauto_show(fname, sp=None, pt_override=None, static=False, Qi=None, special_
     
     return plot_3D(wedge, fs, ptitle)
     
+def sim_path(fname):
+    """
+    Return the file name under which the simulation @fname is saved:
+    @fname itself for a chunked store (see skyflux.store),
+    otherwise the pickle <@fname>.pickle
+    """
+    if sf.store.is_store(fname):
+        return fname
+    return fname + ".pickle"
+
 def load_wedge_sim(fname):
     """
-    Fill out a wedge data structure based on
-        the contents of the file with name @fname.
-    The returned dictionary has the following key-value pairs:
-        "fs": the frequencies used in the simulation
-        "kp": array of k-parallel, the proxy-variable for frequency
-        "ks": a constant coefficient, to be multiplied by
-            baseline lengths to yield k-perpendicular,
-            the proxy-variable for baseline
-        "sim": a three-dimensional array of visibilities
-            the first index corresponds to frequency
-            the second index corresponds to LST
-            the third index corresponds to Stokes parameter
+    Load the wedge simulation saved in the file with name @fname.
+    Returns
+        a skyflux.wedge.Wedge, whose data are an
+            N_bl x N_nu x N_t x 4 array of visibilities
+            the first index corresponds to baseline
+                (see the baseline index table, Wedge.pairs)
+            the second index corresponds to frequency
+            the third index corresponds to LST
+            the fourth index corresponds to Stokes parameter
                 0: I
                 1: Q
                 2: U
                 3: V
+        the frequencies used in the simulation
+        the LSTs used in the simulation
+        the title of the simulation
+    @fname may also be a chunked store (see skyflux.store).
     """
-    sim_file = open(fname, "rb")
+    if sf.store.is_store(fname):
+        wedge, ptitle = sf.store.load_wedge(fname)
+        return wedge, wedge.frequencies, wedge.times, ptitle
 
-    meta = pickle.load(sim_file)
+    with open(fname, "rb") as sim_file:
+        meta = pickle.load(sim_file)
 
-    ptitle = meta['title']
+    wedge = sf.wedge.unpackage(meta)
 
-    fs = meta['frequencies']
-    #print(fs)
-    
-    num_f = len(fs)
-    
-    ts = meta['times']
-    num_t = len(ts)
-    
-    sim = meta['picture']
-    
-    fcd = {} # fourier candidate dictionary
-    
-    for ant1 in sim.keys():
-        fcd[ant1] = {}
-        for ant2 in sim[ant1].keys():
-            # 0: I    1: Q    2: U    3: V
-            fourierc = [[], [], [], []]
-            
-            for ti in range(num_t):
-                for parameter in fourierc:
-                    parameter.append([])
-                
-                for ni in range(num_f):
-                    v = sim[ant1][ant2][ni][ti]
-
-                    for p_idx in range(len(fourierc)):
-                        fourierc[p_idx][ti].append(v[p_idx])
-                
-                for parameter in fourierc:
-                    parameter[ti] = np.array(parameter[ti])
-        
-            for parameter in fourierc:
-                parameter = np.array(parameter)
-
-            fcd[ant1][ant2] = np.array(fourierc)
-
-    return fcd, fs, ts, ptitle    
+    return wedge, wedge.frequencies, wedge.times, meta['title']
        
 def transform_wedge(original, fs, ts):
-    num_f = len(fs)
-    num_t = len(ts)
-    
-    import copy
-    
-    fourier_dict = copy.deepcopy(original)
-
-    window = pol.genWindow(num_f)
-
-    for ant1 in fourier_dict.keys():
-        for ant2 in fourier_dict[ant1].keys():
-            fourier = fourier_dict[ant1][ant2]
-            for ti in range(num_t):
-                for parameter in fourier:
-                    parameter[ti] = np.fft.fft(
-                        parameter[ti] * window
-                    )
-                
-    return fourier_dict
+    """
+    Return the windowed Fourier transform, along frequency,
+    of the Wedge @original.
+    """
+    return original.transform(pol.genWindow(len(fs)))
 
 def collect_wedge_points(fcd, fs, ts, Qi, sp=None,
     special_request=None):
     """
-    Read from the wedge data structure @sim_dict
-        (specifically, one using the format
-        established in load_wedge_sim)
+    Read from the transformed Wedge @fcd
+        (see load_wedge_sim and transform_wedge)
     and generate 3D points appropriate for a wedge plot.
     i.e., return a list of triples:
         (k_perpendicular, k_parallel, power*)
@@ -291,118 +254,117 @@ def collect_wedge_points(fcd, fs, ts, Qi, sp=None,
     universal_p_coeff = square_Jy / (2 * kB) ** 2 / B
     """ """
 
-    for ant1 in fcd.keys():
-        for ant2 in fcd[ant1].keys():
-            if special_request is not None:
-                if ant1 != special_request[0] or \
-                    ant2 != special_request[1]:
-                    continue
+    for b, (ant1, ant2) in enumerate(fcd.pairs.tolist()):
+        if special_request is not None:
+            if ant1 != special_request[0] or \
+                ant2 != special_request[1]:
+                continue
+    
+        baselength = sf.ant.baselength(ant1, ant2)
         
-            baselength = sf.ant.baselength(ant1, ant2)
+        special = [[], [], [], []]
             
-            special = [[], [], [], []]
-                
-            for nu_idx in range(num_f):
-                nua = np.average(fs)
-                nu = fs[nu_idx]
-
-                """ Power constants, section 2 """
-                z = pol.fq2z(nu / 1e9)
-                lambda_ = pol.C / nu
-                lambda_a = pol.C / nua
-                D = pol.transverse_comoving_distance(z)
-                DeltaD = pol.comoving_depth(B, z)
-                # Finally, condense everything into a
-                # power coefficient
-                p_coeff = universal_p_coeff * \
-                    lambda_ ** 4 * D ** 2 * DeltaD
-                """ """
-                k_perp = baselength * pol.k_perp(z) / lambda_
+        for nu_idx in range(num_f):
+            nua = np.average(fs)
+            nu = fs[nu_idx]
+
+            """ Power constants, section 2 """
+            z = pol.fq2z(nu / 1e9)
+            lambda_ = pol.C / nu
+            lambda_a = pol.C / nua
+            D = pol.transverse_comoving_distance(z)
+            DeltaD = pol.comoving_depth(B, z)
+            # Finally, condense everything into a
+            # power coefficient
+            p_coeff = universal_p_coeff * \
+                lambda_ ** 4 * D ** 2 * DeltaD
+            """ """
+            k_perp = baselength * pol.k_perp(z) / lambda_
+            
+            powers_prop = []
+            # store power results by Stokes index:
+            special_powers = [[], [], [], []]
+            # store normalized Hadamard vectors:
+            special_times = []
+            
+            for t_idx in range(num_t - 1):
+                this_instant = \
+                    fcd.data[b, nu_idx, t_idx]
+                next_instant = \
+                    fcd.data[b, nu_idx, t_idx + 1]
                 
-                powers_prop = []
-                # store power results by Stokes index:
-                special_powers = [[], [], [], []]
-                # store normalized Hadamard vectors:
-                special_times = []
+                # [I1, Q1, U1, V1] * [I2*, Q2*, U2*, V2*]
                 
-                for t_idx in range(num_t - 1):
-                    this_instant = \
-                        fcd[ant1][ant2][:, t_idx, nu_idx]
-                    next_instant = \
-                        fcd[ant1][ant2][:, t_idx + 1, nu_idx]
-                    
-                    # [I1, Q1, U1, V1] * [I2*, Q2*, U2*, V2*]
-                    
-                    hadamard = np.multiply(
-                        this_instant, next_instant
-                    )
-                    p = np.dot(Qi, hadamard)
-                    
-                    # if no Stokes parameter is specified,
-                    # we take the absolute value of the
-                    # entire Stokes visibility vector
-                    if sp is None:
-                        sqBr = np.abs(p)
-                    else:
-                        sqBr = np.abs(p[sp])
-                    
-                    powers_prop.append(sqBr)
-                    
-                    # we leave the normalized Hadamard
-                    # products for the cross-section
-                    # code to handle
-                    special_times.append(p)
-                    
-                if special_request is not None:
-                    for vector in np.array(special_times):
-                        # si: Stokes index
-                        for si in range(len(vector)):
-                            # take the magnitude of each
-                            # normalized Hadamard index
-                            param = np.abs(vector[si])
-                            # and count it as a power
-                            special_powers[si].append(param)
-
-                avg = p_coeff * np.average(np.array(powers_prop))
+                hadamard = np.multiply(
+                    this_instant, next_instant
+                )
+                p = np.dot(Qi, hadamard)
                 
-                #print("Using k_parallel", k_par[nu_idx])
+                # if no Stokes parameter is specified,
+                # we take the absolute value of the
+                # entire Stokes visibility vector
+                if sp is None:
+                    sqBr = np.abs(p)
+                else:
+                    sqBr = np.abs(p[sp])
                 
-                wedge_datum = np.array([
-                    k_perp,
-                    k_para[nu_idx],
-                    #float(avg)
-                    float(np.log10(avg))
-                ])
+                powers_prop.append(sqBr)
                 
-                if special_request is not None:
-                    for si in range(len(special_powers)):
-                        special_powers[si] = np.array(
-                            special_powers[si])
-                    
-                    special_powers = np.array(special_powers)
-                
-                    #print("Using k_parallel", k_par[nu_idx])
+                # we leave the normalized Hadamard
+                # products for the cross-section
+                # code to handle
+                special_times.append(p)
                 
+            if special_request is not None:
+                for vector in np.array(special_times):
                     # si: Stokes index
-                    for si in range(len(special_powers)):
-                        stokes_param = special_powers[si]
-                        avg = p_coeff * np.average(stokes_param)
-                        
-                        #!!! duplicate reference
-                        special[si].append(np.array([
-                            k_para[nu_idx],
-                            #float(avg)
-                            float(np.log10(avg))
-                        ]))
-                    
-                visual.append(wedge_datum)
+                    for si in range(len(vector)):
+                        # take the magnitude of each
+                        # normalized Hadamard index
+                        param = np.abs(vector[si])
+                        # and count it as a power
+                        special_powers[si].append(param)
+
+            avg = p_coeff * np.average(np.array(powers_prop))
+            
+            #print("Using k_parallel", k_par[nu_idx])
+            
+            wedge_datum = np.array([
+                k_perp,
+                k_para[nu_idx],
+                #float(avg)
+                float(np.log10(avg))
+            ])
             
-            # Figure 6-esque investigation    
             if special_request is not None:
-                if ant1 == special_request[0] and \
-                    ant2 == special_request[1]:
-                    print("Exiting")
-                    return np.array(special)
+                for si in range(len(special_powers)):
+                    special_powers[si] = np.array(
+                        special_powers[si])
+                
+                special_powers = np.array(special_powers)
+            
+                #print("Using k_parallel", k_par[nu_idx])
+            
+                # si: Stokes index
+                for si in range(len(special_powers)):
+                    stokes_param = special_powers[si]
+                    avg = p_coeff * np.average(stokes_param)
+                    
+                    #!!! duplicate reference
+                    special[si].append(np.array([
+                        k_para[nu_idx],
+                        #float(avg)
+                        float(np.log10(avg))
+                    ]))
+                
+            visual.append(wedge_datum)
+        
+        # Figure 6-esque investigation    
+        if special_request is not None:
+            if ant1 == special_request[0] and \
+                ant2 == special_request[1]:
+                print("Exiting")
+                return np.array(special)
 
     visual = np.array(visual)
    
@@ -522,7 +484,7 @@ def calculate_Q(
     
     dummy_A = sf.stokes.create_A(
         az = 0, alt = 0, nu=151e6, radians=True
-    )
+    )[0]
     Q = np.zeros(dummy_A.shape, dtype=np.complex128)
 
     d3 = dnu * dphi * dtheta
@@ -535,14 +497,13 @@ def calculate_Q(
             for nu_idx in range(len(B)):
                 next_A = sf.stokes.create_A(
                     az=phi, alt=theta, nu=B[nu_idx], radians=True
-                )
+                )[0]
                 Aw = next_A * window[nu_idx]
                 Q += np.multiply(Aw, np.conj(Aw)) * d3
     
     print("Integration complete.")
     
-    #! Disgusting hack
-    return Q[:, 0, :]
+    return Q
 
 def diag(matrix):
     # Be careful! We are assuming that a shallow copy is fine
@@ -1,4 +1,7 @@
 import skyflux.utils
+import skyflux.checkpoint
+import skyflux.wedge
+import skyflux.store
 
 import skyflux.rot
 import skyflux.catalog
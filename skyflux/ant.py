@@ -10,38 +10,327 @@ import pickle
 c = 299792458 # m / s
 data_prefix = os.path.dirname(os.path.abspath(__file__)) + "/"
 
-try:
-    ant_pos = dict(pickle.load(open(data_prefix + "ant_dict.pk", "rb")))
+class AntennaArray:
+    """
+    Array-backed antenna layout, for computing every baseline
+    and phase factor of the array at once.
+    @positions : dictionary of antenna ID # -> (east, north, up) [m],
+        in the format of ant_pos
 
-    def baselength(ant_ID1, ant_ID2):
+    Attributes
+        ids : array of the N_ant antenna ID #s, sorted
+        positions : N_ant x 3 array of coordinates, in the order of ids
+        index : dictionary of antenna ID # -> row of positions
+    """
+    def __init__(self, positions):
+        self.ids = np.array(sorted(positions))
+        self.positions = np.array([positions[ID] for ID in self.ids])
+        self.index = {ID: i for i, ID in enumerate(self.ids)}
+
+    def pairs(self, ordered=True):
+        """
+        Return an N_bl x 2 array of antenna ID # pairs.
+        @ordered
+            True: every (ant1, ant2) with ant1 != ant2, in the order
+                that the nested antenna loops visit them
+            False: only ant1 < ant2
+        """
+        i, j = np.meshgrid(np.arange(len(self.ids)),
+                           np.arange(len(self.ids)), indexing='ij')
+        if ordered:
+            keep = i != j
+        else:
+            keep = i < j
+        return np.stack((self.ids[i[keep]], self.ids[j[keep]]), axis=-1)
+
+    def baselines(self, pairs=None):
+        """
+        Return the N_bl x 3 matrix of baselines
+            position[ant2] - position[ant1]
+        for each row (ant1, ant2) of @pairs (default: self.pairs()).
+        """
+        if pairs is None:
+            pairs = self.pairs()
+        pairs = np.atleast_2d(pairs)
+        rows1 = np.array([self.index[ID] for ID in pairs[:, 0]])
+        rows2 = np.array([self.index[ID] for ID in pairs[:, 1]])
+        return self.positions[rows2] - self.positions[rows1]
+
+    def phase_factors(self, r, nu, pairs=None, baselines=None):
+        """
+        Batched counterpart of phase_factor.
+        @r : (..., 2) array of directions (l, m),
+            e.g. N_src x N_t x 2
+        @nu : float or array of N_nu frequencies [Hz]
+        Baselines come from @baselines (N_bl x 3) if given,
+        otherwise from @pairs (see baselines).
+
+        Returns the (N_bl, ..., N_nu) array of phase factors;
+        as in phase_factor, w is neglected.
         """
-        (Convenience function)
-        Return the norm of the baseline between antennae
-            # @ant_ID1 and @ant_ID2
+        if baselines is None:
+            baselines = self.baselines(pairs)
+        nu = np.atleast_1d(nu)
+        # path difference [m] for every baseline and direction
+        br = np.einsum('bk,...k->b...', baselines[:, 0:2], np.asarray(r))
+        return np.exp(-2j * np.pi / c * br[..., np.newaxis] * nu)
+
+    def baseline_table(self):
+        """
+        Return the table of every ordered baseline, sorted by length:
+            (pairs, lengths, angles)
+            pairs : N_bl x 2 array of (ant1, ant2)
+            lengths : norms of the baselines [m], ascending
+            angles : orientation of the (east, north) components of
+                position[ant2] - position[ant1], in degrees
+                counterclockwise from east (0 = east, 90 = north,
+                180 = west), in (-180, 180]; not a compass bearing
+        Built on the first call and reused afterwards.
         """
-        return np.linalg.norm(baseline(ant_ID1, ant_ID2))
+        if getattr(self, '_table', None) is None:
+            pairs = self.pairs()
+            b = self.baselines(pairs)
+            lengths = np.linalg.norm(b, axis=1)
+            angles = np.degrees(np.arctan2(b[:, 1], b[:, 0]))
+            order = np.argsort(lengths, kind='stable')
+            self._table = (pairs[order], lengths[order], angles[order])
+        return self._table
 
-    def baseline(ant_ID1, ant_ID2):
+    def nearest_length(self, length):
         """
-        Calculate the baseline between antennae
-            # @ant_ID1 and @ant_ID2
-        by a simple difference of their coordinates.
+        Return the (ant1, ant2) pair whose baseline is closest in
+        length to @length [m], by binary search over baseline_table.
         """
-        return ant_pos[ant_ID2] - ant_pos[ant_ID1]
+        pairs, lengths, angles = self.baseline_table()
+        i = np.clip(np.searchsorted(lengths, length), 1, len(lengths) - 1)
+        if abs(lengths[i - 1] - length) <= abs(lengths[i] - length):
+            i -= 1
+        return tuple(pairs[i])
 
-    def phase_factor(ant1, ant2, r, nu=151e6):
+    def find_baselines(self, length=None, angle=None,
+                       length_tol=0.5, angle_tol=1):
         """
-        Calculate the phase factor in the direction @r (l, m)
-            (we assume that n is of insignificant magnitude)
-        and at the frequency @nu
-        between two antennae whose ID #s are @ant1 and @ant2.
-        When we calculate the baseline (u, v, w), we
-            assume that w is of insignificant magnitude.
+        Return the rows of baseline_table, i.e. (pairs, lengths, angles),
+        for every baseline within
+            @length_tol [m] of @length [m], and
+            @angle_tol [degrees] of the orientation @angle [degrees],
+            measured counterclockwise from east as in baseline_table
+            (so @angle=90 selects baselines pointing north).
+        Either criterion can be left out by passing None.
+        The length criterion is answered by binary search.
         """
-        b = baseline(ant1, ant2)[0:2] # kill w
+        pairs, lengths, angles = self.baseline_table()
+        lo, hi = 0, len(lengths)
+        if length is not None:
+            lo = np.searchsorted(lengths, length - length_tol, side='left')
+            hi = np.searchsorted(lengths, length + length_tol, side='right')
+        pairs, lengths, angles = pairs[lo:hi], lengths[lo:hi], angles[lo:hi]
+        if angle is not None:
+            # difference wrapped into [-180, 180)
+            offset = (angles - angle + 180) % 360 - 180
+            keep = np.abs(offset) <= angle_tol
+            pairs, lengths, angles = pairs[keep], lengths[keep], angles[keep]
+        return pairs, lengths, angles
+
+    def redundancy(self, pairs=None, tol=0.1, fold=True):
+        """
+        Group the baselines of @pairs (default: self.pairs())
+        into sets of redundant baselines, i.e. baselines whose
+        (east, north) components agree to within @tol [m].
+        The up component is ignored, as it is in phase_factor.
+
+        If @fold is True, a baseline and its reverse share a group:
+        the visibility of -b is the complex conjugate of that of b.
+
+        Returns (unique_pairs, group, conjugated)
+            unique_pairs : N_red x 2 array, one representative
+                (ant1, ant2) per group
+            group : length-N_bl array, the group of each baseline
+            conjugated : length-N_bl boolean array, True where the
+                baseline is the reverse of its representative
+        Use expand_redundant to go from per-group results back to
+        every baseline.
+        """
+        if pairs is None:
+            pairs = self.pairs()
+        pairs = np.atleast_2d(pairs)
+        b = self.baselines(pairs)[:, 0:2]
+
+        conjugated = np.zeros(len(b), dtype=bool)
+        if fold:
+            # canonical orientation: east component positive,
+            # or north component positive on the north-south line
+            east = np.round(b[:, 0] / tol)
+            north = np.round(b[:, 1] / tol)
+            conjugated = (east < 0) | ((east == 0) & (north < 0))
+            b = np.where(conjugated[:, np.newaxis], -b, b)
+
+        # Bucket the baselines on a grid of spacing tol, then merge
+        # buckets whose centers agree to within tol; the merge is what
+        # keeps groups from splitting across the edge of a grid cell.
+        cells, cell_of = np.unique(
+            np.round(b / tol), axis=0, return_inverse=True)
+        cell_of = cell_of.reshape(-1)
+        counts = np.bincount(cell_of, minlength=len(cells))
+        centers = np.stack([np.bincount(cell_of, weights=b[:, i],
+                                        minlength=len(cells))
+                            for i in range(b.shape[1])], axis=1) / \
+            counts[:, np.newaxis]
+
+        representatives = []
+        cell_group = np.empty(len(cells), dtype=int)
+        for k in range(len(cells)):
+            if representatives:
+                distance = np.linalg.norm(
+                    np.array(representatives) - centers[k], axis=1)
+                match = np.argmin(distance)
+                if distance[match] <= tol:
+                    cell_group[k] = match
+                    continue
+            cell_group[k] = len(representatives)
+            representatives.append(centers[k])
+        group = cell_group[cell_of]
+
+        # first member of each group, oriented like the group
+        _, first = np.unique(group, return_index=True)
+        unique_pairs = pairs[first].copy()
+        flip = conjugated[first]
+        unique_pairs[flip] = unique_pairs[flip][:, ::-1]
+        return unique_pairs, group, conjugated
+
+def expand_redundant(values, group, conjugated):
+    """
+    Expand per-group results to every baseline.
+    @values : array with one entry per redundant group along its
+        first axis, as computed for AntennaArray.redundancy's
+        unique_pairs
+    @group, @conjugated : as returned by AntennaArray.redundancy
+    Returns the array with one entry per baseline.
+    """
+    expanded = values[group]
+    expanded[conjugated] = np.conj(expanded[conjugated])
+    return expanded
+
+### Layout section ###
+
+"""
+The layout is read only when something first asks for it
+(ant.ant_pos, ant.array, or any of the functions below),
+and swapping in another layout at runtime is a matter of
+calling set_layout or load_layout.
+The preferred format is a pickle-free .npz with two arrays:
+    ids : the N_ant antenna ID #s
+    positions : N_ant x 3 coordinates [m]
+"""
+layout_origin = data_prefix + "ant_layout.npz"
+legacy_origin = data_prefix + "ant_dict.pk"
+
+_ant_pos = None
+_array = None
+
+def save_layout(positions, filepath):
+    """
+    Write the layout @positions (dictionary of antenna ID # ->
+    coordinates, as in ant_pos) to the .npz file at @filepath.
+    """
+    ids = np.array(sorted(positions))
+    np.savez(filepath, ids=ids,
+             positions=np.array([positions[ID] for ID in ids]))
+
+def read_layout(filepath):
+    """
+    Return the layout stored at @filepath as a dictionary of
+    antenna ID # -> coordinates. A .pk file is taken to be
+    a legacy pickled dictionary; anything else is read as .npz.
+    """
+    if filepath.endswith(".pk"):
+        with open(filepath, "rb") as f:
+            return dict(pickle.load(f))
+    saves = np.load(filepath, allow_pickle=False)
+    return dict(zip(saves['ids'], saves['positions']))
+
+def set_layout(positions):
+    """
+    Make @positions (dictionary of antenna ID # -> coordinates)
+    the current layout, discarding any derived AntennaArray.
+    """
+    global _ant_pos
+    global _array
+    _ant_pos = dict(positions)
+    _array = None
+
+def load_layout(filepath=None):
+    """
+    Make the layout stored at @filepath the current one
+        (default: the layout shipped with the package,
+        falling back on the legacy pickle).
+    """
+    if filepath is None:
+        filepath = layout_origin
+        if not os.path.exists(filepath):
+            filepath = legacy_origin
+    set_layout(read_layout(filepath))
+
+def get_ant_pos():
+    """
+    Return the current layout, as a dictionary of
+    antenna ID # -> coordinates, loading it on the first call.
+    """
+    if _ant_pos is None:
+        try:
+            load_layout()
+        except FileNotFoundError:
+            print("Failure to load antennae data.")
+            raise
+    return _ant_pos
+
+def get_array():
+    """
+    Return the AntennaArray of the current layout,
+    building it on the first call.
+    """
+    global _array
+    if _array is None:
+        _array = AntennaArray(get_ant_pos())
+    return _array
+
+def __getattr__(name):
+    # Module-level attribute hook (PEP 562), so that
+    # ant.ant_pos and ant.array keep working without an eager load.
+    if name == "ant_pos":
+        return get_ant_pos()
+    if name == "array":
+        return get_array()
+    raise AttributeError(
+        "module " + repr(__name__) + " has no attribute " + repr(name))
+
+def baselength(ant_ID1, ant_ID2):
+    """
+    (Convenience function)
+    Return the norm of the baseline between antennae
+        # @ant_ID1 and @ant_ID2
+    """
+    return np.linalg.norm(baseline(ant_ID1, ant_ID2))
+
+def baseline(ant_ID1, ant_ID2):
+    """
+    Calculate the baseline between antennae
+        # @ant_ID1 and @ant_ID2
+    by a simple difference of their coordinates.
+    """
+    ant_pos = get_ant_pos()
+    return ant_pos[ant_ID2] - ant_pos[ant_ID1]
+
+def phase_factor(ant1, ant2, r, nu=151e6):
+    """
+    Calculate the phase factor in the direction @r (l, m)
+        (we assume that n is of insignificant magnitude)
+    and at the frequency @nu
+    between two antennae whose ID #s are @ant1 and @ant2.
+    When we calculate the baseline (u, v, w), we
+        assume that w is of insignificant magnitude.
+    """
+    b = baseline(ant1, ant2)[0:2] # kill w
 
-        br = np.dot(b, r)
-        return np.exp(-2j * np.pi * nu * br / c)
-    
-except FileNotFoundError:
-    print("Failure to load antennae data.")
+    br = np.dot(b, r)
+    return np.exp(-2j * np.pi * nu * br / c)
@@ -1,4 +1,5 @@
 import numpy as np
+import healpy as hp
 
 from skyflux import rot
 
@@ -119,13 +120,237 @@ class GLEAM_entry:
     # we will probably want a __repr__ function so that we can see
     # ALL fluxes associated with the object.
 
+# Columnar alternative to an array of GLEAM_entry objects.
+# One record per source:
+#     name
+#     ra, dec : position in radians
+#     alpha : spectral index (NaN if missing)
+#     flux : integrated flux [Jy] at each of expected_frequencies
+#         (NaN if missing)
+# Having no object fields, it is stored without pickling and
+# can be memory-mapped straight off of the disk.
+table_dtype = np.dtype([
+    ('name', 'U32'),
+    ('ra', np.float64),
+    ('dec', np.float64),
+    ('alpha', np.float64),
+    ('flux', np.float64, (len(expected_frequencies),))
+])
+
+def frq_index(frq):
+    """
+    Return the column of table['flux'] that corresponds
+    to the GLEAM frequency @frq (in MHz).
+    """
+    return expected_frequencies.index(frq)
+
+def entries_to_table(entries):
+    """
+    Return the columnar catalog table corresponding to
+    the iterable @entries of GLEAM_entry objects.
+    """
+    entries = list(entries)
+    table = np.zeros(len(entries), dtype=table_dtype)
+    table['name'] = [entry.name for entry in entries]
+    table['ra'] = np.radians([entry.ra_angle for entry in entries])
+    table['dec'] = np.radians([entry.dec_angle for entry in entries])
+    table['alpha'] = [entry.alpha for entry in entries]
+    # hand-built entries may lack some bands; those are NaN,
+    # as in parse_gleam
+    table['flux'] = [[entry.flux_by_frq.get(frq, np.nan)
+                      for frq in expected_frequencies]
+                     for entry in entries]
+    return table
+
+def parse_gleam(filepath):
+    """
+    Bulk counterpart of GLEAM_entry: read the whole pipe-delimited
+    catalog excerpt at @filepath (same layout, one source per line,
+    with a leading "|") straight into a columnar catalog table.
+
+    Instead of a warning per missing field, return two masks:
+    Returns (table, missing_flux, missing_alpha), where
+        missing_flux : N x len(expected_frequencies) boolean array
+        missing_alpha : length-N boolean array
+    and the corresponding entries of table are NaN.
+    """
+    with open(filepath, "r") as f:
+        rows = [line.split("|") for line in f if line.strip()]
+
+    n_frq = len(expected_frequencies)
+    # name, ra, dec, fluxes, alpha, after the leading empty field
+    fields = np.array([row[1:5 + n_frq] for row in rows])
+
+    def to_float(column):
+        column = np.char.strip(column)
+        missing = column == ''
+        return np.where(missing, 'nan', column).astype(float), missing
+
+    fluxes, missing_flux = to_float(fields[:, 3:3 + n_frq])
+    alpha, missing_alpha = to_float(fields[:, 3 + n_frq])
+
+    ra_parts = np.array(
+        [ra.split() for ra in fields[:, 1]], dtype=float)
+    dec_parts = np.array(
+        [dec.split() for dec in fields[:, 2]], dtype=float)
+
+    table = np.zeros(len(fields), dtype=table_dtype)
+    table['name'] = fields[:, 0]
+    table['ra'] = rot.collapse_hour(
+        ra_parts[:, 0], ra_parts[:, 1], ra_parts[:, 2], radians=True)
+    table['dec'] = rot.collapse_angle(
+        dec_parts[:, 0], dec_parts[:, 1], dec_parts[:, 2], radians=True)
+    table['alpha'] = alpha
+    # mJy -> Jy
+    table['flux'] = fluxes / 1000
+
+    return table, missing_flux, missing_alpha
+
+def save_table(table, filepath):
+    """
+    Write the columnar catalog @table to the .npy file at @filepath.
+    """
+    np.save(filepath, table, allow_pickle=False)
+
+def load_table(filepath):
+    """
+    Read a columnar catalog table from the .npy file at @filepath.
+    The file is memory-mapped read-only, so nothing is copied
+    until a column is actually used.
+    """
+    return np.load(filepath, mmap_mode='r', allow_pickle=False)
+
 data_prefix = os.path.dirname(os.path.abspath(__file__)) + "/"
 
 try:
     srcs = np.load(data_prefix + 'catalog.npy', allow_pickle=True)
 except FileNotFoundError:
     print("Failure to load GLEAM object array.")
+
+try:
+    table = load_table(data_prefix + 'catalog_table.npy')
+except FileNotFoundError:
+    # fall back on converting the object array, if we have it
+    try:
+        table = entries_to_table(srcs)
+    except NameError:
+        print("Failure to load GLEAM catalog table.")
     
+# Name -> index (into srcs and table) map, so that
+# looking up a source by name is a single hash.
+# Names are also kept sorted, for prefix searches by bisection.
+try:
+    name_to_index = {name: i for i, name in enumerate(table['name'])}
+    _sorted_order = np.argsort(table['name'])
+    _sorted_names = np.asarray(table['name'])[_sorted_order]
+except NameError:
+    name_to_index = {}
+
+def lookup(name):
+    """
+    Given the @name field for a GLEAMEGCAT object,
+    return the index (in srcs and table) corresponding to that object.
+
+    Returns -1 if the name was not found in the catalog.
+    """
+    return name_to_index.get(name, -1)
+
+def search(fragment, prefix=False):
+    """
+    Return the sorted indices (in srcs and table) of every source
+    whose name contains the string @fragment.
+    If @prefix is True, the name must instead begin with @fragment,
+    which is answered by bisection over the sorted names.
+    """
+    if prefix:
+        # every name beginning with fragment sorts between
+        # fragment itself and fragment followed by the highest code point
+        lo = np.searchsorted(_sorted_names, fragment, side='left')
+        hi = np.searchsorted(_sorted_names, fragment + chr(0x10FFFF),
+                             side='left')
+        return np.sort(_sorted_order[lo:hi])
+    return np.flatnonzero(np.char.find(table['name'], fragment) >= 0)
+
+# Query section: each filter returns a boolean mask over table,
+# and query combines them into an array of indices.
+
+def flux_window(start=None, end=None, frq=151):
+    """
+    Return the mask of the sources whose flux at the frequency
+        @frq (in MHz)
+    is at least @start [Jy] and at most @end [Jy].
+    To leave an extreme unbounded, enter None as that value.
+    Sources with a missing flux never pass.
+    """
+    flux = table['flux'][:, frq_index(frq)]
+    mask = ~np.isnan(flux)
+    if start is not None:
+        mask &= flux >= start
+    if end is not None:
+        mask &= flux <= end
+    return mask
+
+def alpha_valid():
+    """
+    Return the mask of the sources with a specified spectral index.
+    """
+    return ~np.isnan(table['alpha'])
+
+def dec_band(low=None, high=None, radians=False):
+    """
+    Return the mask of the sources with declination between
+    @low and @high (inclusive; None leaves that side unbounded).
+    @radians classifies the units of @low and @high.
+    """
+    dec = table['dec']
+    if not radians:
+        dec = np.degrees(dec)
+    mask = np.ones(len(table), dtype=bool)
+    if low is not None:
+        mask &= dec >= low
+    if high is not None:
+        mask &= dec <= high
+    return mask
+
+def brightest(k=1, frq=151, mask=None):
+    """
+    Return the indices of the @k sources with the highest flux at
+    the frequency @frq (in MHz), brightest first,
+    among the sources selected by the boolean @mask (default: all).
+    """
+    flux = table['flux'][:, frq_index(frq)]
+    candidates = np.flatnonzero(~np.isnan(flux))
+    if mask is not None:
+        candidates = candidates[mask[candidates]]
+    k = min(k, len(candidates))
+    if k == 0:
+        return candidates
+    # partial sort, then order only the k winners
+    top = candidates[np.argpartition(-flux[candidates], k - 1)[:k]]
+    return top[np.argsort(-flux[top], kind='stable')]
+
+def query(min_flux=None, max_flux=None, frq=151, valid_alpha=False,
+          dec_range=None, top=None, radians=False):
+    """
+    Return the indices (in srcs and table) of the sources satisfying
+    every requested constraint:
+        @min_flux, @max_flux : flux window [Jy] at @frq (in MHz)
+        @valid_alpha : if True, the spectral index must be specified
+        @dec_range : (low, high) declination band (see dec_band)
+        @top : if given, only the @top brightest survivors at @frq,
+            brightest first; otherwise the indices are in catalog order
+    """
+    mask = np.ones(len(table), dtype=bool)
+    if min_flux is not None or max_flux is not None:
+        mask &= flux_window(min_flux, max_flux, frq)
+    if valid_alpha:
+        mask &= alpha_valid()
+    if dec_range is not None:
+        mask &= dec_band(dec_range[0], dec_range[1], radians)
+    if top is not None:
+        return brightest(top, frq, mask)
+    return np.flatnonzero(mask)
+
 def idxs_to_objs(indices):
     objs = []
     for i in indices:
@@ -133,3 +358,90 @@ def idxs_to_objs(indices):
     return np.array(objs)
     
 
+
+class SkyIndex:
+    """
+    HEALPix-pixel index over a set of source positions, for quickly
+    finding the sources that are up at a given LST.
+    @ra, @dec : arrays of source positions, in radians
+    @nside : resolution of the pixelization used to bucket the sources
+
+    Indices returned by the queries refer to the order of @ra and @dec,
+    i.e. to catalog.table for the index returned by sky_index.
+    """
+    def __init__(self, ra, dec, nside=16):
+        self.nside = nside
+        self.ra = np.asarray(ra, dtype=float)
+        self.dec = np.asarray(dec, dtype=float)
+
+        theta = np.pi / 2 - self.dec
+        self.vectors = np.array(hp.ang2vec(theta, self.ra)).reshape(-1, 3)
+
+        # CSR-style buckets: the sources in pixel p are
+        # order[offsets[p]:offsets[p + 1]]
+        pixels = hp.ang2pix(nside, theta, self.ra)
+        self.order = np.argsort(pixels, kind='stable')
+        self.offsets = np.searchsorted(
+            pixels[self.order], np.arange(hp.nside2npix(nside) + 1))
+
+    def candidates(self, pixels):
+        """
+        Return the indices of every source in the HEALPix @pixels.
+        """
+        starts = self.offsets[pixels]
+        stops = self.offsets[np.asarray(pixels) + 1]
+        if len(starts) == 0:
+            return np.array([], dtype=int)
+        return np.concatenate([
+            self.order[start:stop] for start, stop in zip(starts, stops)
+        ])
+
+    def visible(self, lst, lat=None, min_alt=0, gain=None, min_gain=0):
+        """
+        Return the sorted indices of the sources above the altitude
+            @min_alt [radians]
+        at local sidereal time @lst [radians]
+        for an observer at latitude @lat [radians] (default: HERA array).
+
+        If @gain is given, it must be a function of (az, alt) [radians]
+        returning the beam gain for arrays of positions,
+        and only the sources with at least @min_gain are kept.
+        """
+        if lat is None:
+            lat = np.radians(rot.hera_lat)
+
+        # The zenith sits at (ra, dec) = (lst, lat), and a source's
+        # altitude is the complement of its angular distance from it.
+        zenith = hp.ang2vec(np.pi / 2 - lat, lst)
+        pixels = hp.query_disc(
+            self.nside, zenith, np.pi / 2 - min_alt, inclusive=True)
+        cand = self.candidates(pixels)
+        above = np.dot(self.vectors[cand], zenith) >= np.sin(min_alt)
+        idx = np.sort(cand[above])
+
+        if gain is not None and len(idx) > 0:
+            az, alt = rot.eq_to_topo_batch(
+                self.ra[idx], self.dec[idx], lat=lat, lst=lst, radians=True)
+            idx = idx[np.asarray(gain(az[:, 0], alt[:, 0])) >= min_gain]
+        return idx
+
+    def visible_during(self, lsts, lat=None, min_alt=0,
+                       gain=None, min_gain=0):
+        """
+        Return the sorted indices of the sources that are visible
+        (see visible) at any of the local sidereal times in @lsts.
+        """
+        visible = [self.visible(lst, lat, min_alt, gain, min_gain)
+                   for lst in np.atleast_1d(lsts)]
+        return np.unique(np.concatenate(visible))
+
+_sky_indices = {}
+
+def sky_index(nside=16):
+    """
+    Return the SkyIndex over catalog.table at resolution @nside,
+    building it only on the first request.
+    """
+    if nside not in _sky_indices:
+        _sky_indices[nside] = SkyIndex(table['ra'], table['dec'], nside)
+    return _sky_indices[nside]
@@ -0,0 +1,157 @@
+"""
+Checkpointing for long, source-by-source simulations.
+
+A simulation that sums the contributions of many sources periodically
+records its running state together with the exact set of sources
+already folded into that state. If the run dies, calling it again
+with the same parameters picks up from the last checkpoint
+instead of starting over.
+"""
+
+import os
+import pickle
+
+import numpy as np
+
+def _same(a, b):
+    """
+    Return True if the parameter values @a and @b are equal,
+    where either may be a scalar, a list or an array.
+    """
+    try:
+        return np.array_equal(np.asarray(a), np.asarray(b))
+    except (TypeError, ValueError):
+        return a == b
+
+class Checkpoint:
+    """
+    On-disk progress of a simulation that accumulates over sources.
+
+    @path : file to which the checkpoint is written
+    @params : dictionary of the simulation parameters
+        (axes, baselines, ...). A checkpoint is only resumed
+        by a run with exactly the same parameters.
+    @interval : number of completed sources between writes
+
+    Typical use:
+        ckpt = Checkpoint(path, params)
+        state = ckpt.resume(initial_state)
+        for source in sources:
+            if source.name in ckpt.done:
+                continue
+            state = <fold source into state>
+            ckpt.update(state, source.name)
+        <write the output>
+        sync(<output path>)
+        ckpt.finish(state)
+    """
+    def __init__(self, path, params, interval=4):
+        self.path = path
+        self.params = params
+        self.interval = interval
+        self.done = set()
+        self.unsaved = 0
+
+    def resume(self, state=None):
+        """
+        Return the state saved at self.path, and mark its sources
+        as done, if the file exists and its parameters match.
+        Otherwise start afresh from @state.
+        """
+        if not os.path.exists(self.path):
+            return state
+
+        with open(self.path, 'rb') as handle:
+            saved = pickle.load(handle)
+
+        if saved['params'].keys() != self.params.keys() or \
+           not all(_same(saved['params'][k], self.params[k])
+                   for k in self.params):
+            raise ValueError("The checkpoint at " + self.path + \
+                " belongs to a run with different parameters." + \
+                " Move it aside to start a new run.")
+
+        self.done = set(saved['done'])
+        print("Resuming from " + self.path + " with " + \
+              str(len(self.done)) + " sources done.")
+        return saved['state']
+
+    def save(self, state):
+        """
+        Write @state and the set of completed sources to self.path.
+        The checkpoint is first written in full to a temporary file,
+        which then replaces the old one, so a crash mid-write never
+        leaves a corrupt or partial checkpoint behind.
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'wb') as handle:
+            pickle.dump({'params' : self.params,
+                         'done' : sorted(self.done),
+                         'state' : state},
+                        handle, protocol=pickle.HIGHEST_PROTOCOL)
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temp_path, self.path)
+        # the rename itself lives in the directory
+        _fsync_directory(os.path.dirname(os.path.abspath(self.path)))
+        self.unsaved = 0
+
+    def update(self, state, source_id):
+        """
+        Record that the source @source_id has been folded into @state,
+        writing a checkpoint once every self.interval sources.
+        """
+        self.done.add(source_id)
+        self.unsaved += 1
+        if self.unsaved >= self.interval:
+            self.save(state)
+
+    def finish(self, state, remove=True):
+        """
+        Mark the run as complete. The checkpoint file is deleted
+        if @remove, otherwise it is brought up to date.
+        Until the final output of the run is safely on disk
+        (see sync), the checkpoint is the only copy of the result,
+        so only remove it after that.
+        """
+        if remove:
+            discard(self.path)
+        else:
+            self.save(state)
+
+def _fsync_directory(path):
+    """
+    Flush the entries of the directory @path (new, renamed or
+    deleted files) to disk, where directories can be opened.
+    """
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def sync(path):
+    """
+    Flush the file @path, or every file under the directory @path,
+    to disk, together with the directory entries that name them.
+    Call this on the output of a run before discarding its checkpoint.
+    """
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in files:
+                with open(os.path.join(root, name), 'rb') as handle:
+                    os.fsync(handle.fileno())
+            _fsync_directory(root)
+    else:
+        with open(path, 'rb') as handle:
+            os.fsync(handle.fileno())
+    _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+def discard(path):
+    """
+    Delete the checkpoint at @path, if there is one.
+    """
+    if os.path.exists(path):
+        os.remove(path)
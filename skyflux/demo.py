@@ -1,6 +1,6 @@
 """
 Utilities for displaying various plots concerning the distributions
-of the GLEAM objects in the parser buffer (catalog.obj_catalog).
+of the GLEAM objects in the catalog (catalog.srcs and catalog.table).
 """
 
 import math
@@ -78,7 +78,7 @@ np.savez_compressed('14m_single_source',
 np.savez_compressed('30m_single_source',
     frequency_axis=nu30_s, lst_axis=lst30_s, visibility_tensor=vt30_s)
 """
-def vis_tensor(ant1, ant2, sources=None):
+def vis_tensor(ant1, ant2, sources=None, memory_budget=None):
     """
     Returns a giant block of visibility sums.
     The first return value is the x-axis, also known as the first index.
@@ -88,6 +88,8 @@ def vis_tensor(ant1, ant2, sources=None):
     The third return value is the z-axis, also known as the data block.
         It describes the summed visibilities of all ~3000 catalog objects
         for a given time and frequency.
+    @memory_budget caps the scratch memory [bytes] of each chunk
+        of sources (see vis.chunk_size).
 
     def vis_tensor(ant1, ant2, sources=None):
 
@@ -123,30 +125,20 @@ def vis_tensor(ant1, ant2, sources=None):
     import time as t
     print("Unix time upon function call:", str(t.time()))
 
-    percent_interval = 100 / 144 / 150
-    
     nu_axis = np.arange(77e6, 226e6 + MACRO_EPSILON, 1e6)
     t_axis = np.arange(0, 2 * np.pi, np.pi / 72)
-    v_tensor = []
 
     if sources is None:
-        sources = catalog.obj_catalog.copy()
-
-    percent = 0
-    for nu in nu_axis:
-        v_tensor.append([])
-        for t in t_axis:
-            next_vista = np.array([0j, 0j, 0j, 0j])
-            for source in sources:
-                next_vista += vis.visibility(ant1, ant2, source, nu=nu, time=t)
-
-            percent += percent_interval
-            v_tensor[len(v_tensor) - 1].append(next_vista)
+        sources = catalog.query(valid_alpha=True)
 
-            percent_status = str(np.around(percent, 4))
-            print("Visibility tensor: " + percent_status + "% complete.")
+    def report(done, total):
+        percent_status = str(np.around(100 * done / total, 4))
+        print("Visibility tensor: " + percent_status + "% complete.")
 
-    return nu_axis, t_axis, np.array(v_tensor)
+    # see vis.visibilities for the chunked evaluation
+    return nu_axis, t_axis, vis.visibilities(
+        ant1, ant2, sources, t_axis, nu_axis,
+        memory_budget=memory_budget, progress=report)
 
 ### todo: we want a command that will force all of the scales to run from the same values
 
@@ -257,11 +249,10 @@ def lookup(name):
     return the index (in the master array) corresponding to that object.
 
     Returns -1 if the name was not found in the catalog.
+
+    This is a constant-time hash lookup; see catalog.lookup.
     """
-    for i in range(len(catalog.obj_catalog)):
-        if catalog.obj_catalog[i].name == name:
-            return i
-    return -1
+    return catalog.lookup(name)
 
 def cleaned_list():
     """
@@ -269,14 +260,7 @@ def cleaned_list():
     unspecified spectral indices. By construction, objects without spectral indices were
     automatically assigned 'NaN' for the field.
     """
-    ws_oc = catalog.obj_catalog.copy() # write-safe read copy for the GLEAM object catalog
-    cat = catalog.obj_catalog.copy()
-    # we loop in reverse, to avoid concurrent modification exceptions
-    for i in range(len(ws_oc) - 1, 0, -1):
-        # classic. The easiest way to check if a value is NaN: it does not equal itself
-        if ws_oc[i].alpha != ws_oc[i].alpha:
-            del cat[i]
-    return cat
+    return list(catalog.srcs[catalog.query(valid_alpha=True)])
 
 def sources_range(start=3, end=5, frq=151):
     """
@@ -288,37 +272,37 @@ def sources_range(start=3, end=5, frq=151):
     This function also prints the number of such sources encountered.
     """
     assert start < end, "Requested range must be of positive width"
-    valid_sources = []
-    for gleam_obj in catalog.obj_catalog:
-        if gleam_obj.flux_by_frq[frq] <= end and \
-           gleam_obj.flux_by_frq[frq] >= start:
-            valid_sources.append(gleam_obj)
+    valid_sources = list(catalog.srcs[catalog.query(start, end, frq)])
     print("Number of valid sources encountered:", len(valid_sources))
     return valid_sources
 
-def brightest_source(frq=151, sliced_list=catalog.srcs):
+def brightest_source(frq=151, sliced_list=None):
     """
     Return the source with the highest value for integrated flux
         at frequency @frq (in MHz).
     The source must also satisfy the
     query constaints described in resources/GLEAM_guide.txt.
 
-    There is no error checking to make sure @frq is a valid frequency.
+    @sliced_list: list of GLEAM objects to search
+        default: the whole catalog, which is searched through
+        the columnar table (see catalog.brightest)
+
+    A frequency missing from catalog.expected_frequencies raises ValueError.
     """
-    max_obj = sliced_list[0]
-    for gleam_obj in sliced_list:
-        if gleam_obj.flux_by_frq[frq] > max_obj.flux_by_frq[frq]:
-            max_obj = gleam_obj
+    if sliced_list is None:
+        max_obj = catalog.srcs[catalog.brightest(1, frq)[0]]
+    else:
+        max_obj = max(sliced_list, key=lambda obj: obj.flux_by_frq[frq])
     print("Largest flux value encountered:", max_obj.flux_by_frq[frq])
     print("Name of associated object:", max_obj.name)
     print("Index of associated object:", lookup(max_obj.name))
     return max_obj
 
-def hist_data(list_source, frq=151, ln=False, data_lim=None):
+def hist_data(list_source=None, frq=151, ln=False, data_lim=None):
     """
     For every GLEAM_entry object
         as defined in catalog.py
-    in @list_source,
+    in @list_source (default: the whole catalog),
     extract its flux at frequency @frq (in MHz)
 
     Return an array containing those fluxes which
@@ -341,6 +325,13 @@ def hist_data(list_source, frq=151, ln=False, data_lim=None):
         max_acceptable = data_lim[1]
     else:
         max_acceptable = None
+
+    if list_source is None:
+        idx = catalog.query(min_acceptable, max_acceptable, frq)
+        fluxes = catalog.table['flux'][idx, catalog.frq_index(frq)]
+        if ln:
+            return np.log(fluxes)
+        return np.array(fluxes)
         
     for gleam_obj in list_source:
         I = gleam_obj.flux_by_frq[frq]
@@ -370,7 +361,7 @@ def brightness_distr(frq=151, ln=False, data_lim=None, ylim=None):
             data_lim = (2, None)
         will give all sources brighter than 2 Jy.
     """
-    fluxes = hist_data(catalog.obj_catalog, frq, ln, data_lim)
+    fluxes = hist_data(None, frq, ln, data_lim)
     # Naive application of Sturge's Rule to get number of bins
     K = math.ceil(1 + 3.322 * np.log(len(fluxes)))
 
@@ -409,19 +400,13 @@ def list_baselines(ant_ID):
         if ant_ID != ID:
             print(str(ID) + ": " + str(ant.baseline(ant_ID, ID)))
 
-active_ants = list(ant.ant_pos)
-active_ants.sort()
-
 def all_baselines():
     """
     Print every available baseline, without duplicating.
     """
-    for i in range(len(active_ants)):
-        ID1 = active_ants[i]
-        for j in range(i + 1, len(active_ants[i + 1:])):
-            ID2 = active_ants[j]
-            print("Baseline between antennae " + str(ID1) + \
-                  " and " + str(ID2) + " = " + str(ant.baseline(ID1, ID2)))
+    for ID1, ID2 in ant.array.pairs(ordered=False):
+        print("Baseline between antennae " + str(ID1) + \
+              " and " + str(ID2) + " = " + str(ant.baseline(ID1, ID2)))
 
 def find_baseline(objective):
     """
@@ -429,20 +414,15 @@ def find_baseline(objective):
         (antenna 1 ID #, antenna 2 ID #)
     that is closest in length to
     objective out of all possible antenna pairs.
+
+    See ant.AntennaArray.find_baselines to search by orientation
+    as well, for example
+        ant.array.find_baselines(14, angle=180)
+    for the 14 m pairs whose second antenna lies due west of the first
+    (angles are counterclockwise from east).
     """
-    best_err = float('inf')
-    best_ants = None
-    
-    for i in range(len(active_ants)):
-        ID1 = active_ants[i]
-        for j in range(i + 1, len(active_ants[i + 1:])):
-            ID2 = active_ants[j]
-            b = ant.baseline(ID1, ID2)
-            sq_err = (objective - np.linalg.norm(b)) ** 2
-
-            if sq_err < best_err:
-                best_err = sq_err
-                best_ants = (ID1, ID2)
+    best_ants = ant.array.nearest_length(objective)
+    best_err = (objective - ant.baselength(*best_ants)) ** 2
 
     print("Best squared error:", best_err)
     return best_ants
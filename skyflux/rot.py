@@ -1,3 +1,5 @@
+import collections
+
 import numpy as np
 import time
 import astropy.time
@@ -94,6 +96,39 @@ def M_ha_to_topo(phi=None, radians=False):
     c = np.cos(phi)
     return np.array([[-s, 0, c], [0, -1, 0], [c, 0, s]])
 
+def M_eq_to_topo(lst=None, lat=None, radians=False):
+    """
+    Return the stack of change-of-basis matrices between the equatorial
+    and topocentric coordinate systems, one per entry of
+        local sidereal time @lst : float or array of length N_t
+    for an observer at
+        latitude @lat : float
+        (default is HERA array).
+    The result has shape (N_t, 3, 3) and is the product
+        M_ha_to_topo(lat) . M_eq_to_ha(lst)
+    evaluated for every LST at once.
+    @radians: classifies the units of @lst and @lat
+    """
+    if lst is None:
+        lst = get_lst(radians=True)
+    elif not radians:
+        lst = np.radians(lst)
+    if lat is not None and not radians:
+        lat = np.radians(lat)
+
+    lst = np.atleast_1d(np.asarray(lst, dtype=float))
+    s = np.sin(lst)
+    c = np.cos(lst)
+
+    M_ha = np.zeros((len(lst), 3, 3))
+    M_ha[:, 0, 0] = c
+    M_ha[:, 0, 1] = s
+    M_ha[:, 1, 0] = s
+    M_ha[:, 1, 1] = -c
+    M_ha[:, 2, 2] = 1
+
+    return np.matmul(M_ha_to_topo(lat, radians=True), M_ha)
+
 def rectangle(a, b, radians=False):
     """
     Given a pair of angles
@@ -160,6 +195,39 @@ def eq_to_topo(ra, dec, lat=None, lst=None, radians=False):
     topo_vector = np.dot(M_ha_to_topo(lat, radians=True), ha_vector)
     return new_sphere(topo_vector, radians)
 
+def eq_to_topo_batch(ra, dec, lat=None, lst=None, radians=False):
+    """
+    Vectorized counterpart of eq_to_topo, with the same arguments
+    in the same order.
+    Convert the equatorial positions
+        (right ascension = @ra, declination = @dec),
+        each a float or an array of length N_src,
+    at every local sidereal time in
+        @lst : float or array of length N_t
+        (default: time of execution)
+    to topocentric coordinates, using one broadcast rotation.
+
+    Returns (az, alt), each of shape (N_src, N_t).
+
+    @radians determines the interpretation of BOTH the input
+    and output. By default everything is in degrees.
+    """
+    if not radians:
+        ra = np.radians(ra)
+        dec = np.radians(dec)
+        if lst is not None:
+            lst = np.radians(lst)
+        if lat is not None:
+            lat = np.radians(lat)
+
+    ra = np.atleast_1d(ra)
+    dec = np.atleast_1d(dec)
+
+    eq_vectors = rectangle(ra, dec, radians=True) # 3 x N_src
+    M = M_eq_to_topo(lst, lat, radians=True) # N_t x 3 x 3
+    topo_vectors = np.einsum('tij,js->ist', M, eq_vectors)
+    return new_sphere(topo_vectors, radians)
+
 def ha_to_eq(ha, dec, lat, radians=False):
     """
     Convert a position in the hour-angle format
@@ -297,6 +365,135 @@ def radec2lm(ra, dec, ra0=None, dec0=np.radians(hera_lat)):
         np.sin(dec) * np.cos(dec0)
     return l, m
 
+def radec2lm_batch(ra, dec, ra0, dec0=np.radians(hera_lat)):
+    """
+    Vectorized counterpart of radec2lm.
+    ra   : right ascensions in radians; float or array of length N_src
+    dec  : declinations in radians; float or array of length N_src
+    ra0  : reference/phase right ascensions, in radians;
+        float or array of length N_t (typically an LST axis)
+    dec0 : reference/phase declination; type: float
+         (default: latitude of the HERA array)
+
+    Returns (l, m), each of shape (N_src, N_t).
+    """
+    ra = np.atleast_1d(ra)[:, np.newaxis]
+    dec = np.atleast_1d(dec)[:, np.newaxis]
+    ra0 = np.atleast_1d(ra0)[np.newaxis, :]
+
+    cos_dec = np.cos(dec)
+    l = cos_dec * np.sin(ra0 - ra)
+    m = cos_dec * np.sin(dec0) * np.cos(ra - ra0) - \
+        np.sin(dec) * np.cos(dec0)
+    return l, m
+
+class ObservationGeometry:
+    """
+    Precomputed rotations for a fixed time axis and observer.
+    Every source simulated over the same
+        @t_axis : array of local sidereal times
+    and at the same
+        @lat : latitude of the observer (default: HERA array)
+    reuses the equatorial -> topocentric rotation stack and the
+    sine and cosine of the time axis, instead of rebuilding them
+    for each source.
+
+    @radians classifies the units of @t_axis and @lat;
+    the stored attributes are always in radians.
+
+    Use observation_geometry rather than constructing this directly,
+    so that repeated requests for the same axis share one instance.
+    """
+    def __init__(self, t_axis, lat=None, radians=False):
+        t_axis = np.atleast_1d(np.array(t_axis, dtype=float))
+        if lat is None:
+            lat = np.radians(hera_lat)
+        elif not radians:
+            lat = np.radians(lat)
+        if not radians:
+            t_axis = np.radians(t_axis)
+
+        self.t_axis = t_axis
+        self.lat = lat
+        # N_t x 3 x 3
+        self.M = M_eq_to_topo(t_axis, lat, radians=True)
+        self.sin_t = np.sin(t_axis)
+        self.cos_t = np.cos(t_axis)
+
+    def topo(self, ra, dec):
+        """
+        Return (az, alt), each of shape (N_src, N_t), for the
+        equatorial positions (@ra, @dec) [radians] at every LST
+        of the time axis.
+        """
+        eq_vectors = rectangle(
+            np.atleast_1d(ra), np.atleast_1d(dec), radians=True)
+        topo_vectors = np.einsum('tij,js->ist', self.M, eq_vectors)
+        return new_sphere(topo_vectors, radians=True)
+
+    def lm(self, ra, dec, dec0=None):
+        """
+        Return the direction cosines (l, m), each of shape (N_src, N_t),
+        of the positions (@ra, @dec) [radians] phased to every LST
+        of the time axis. See radec2lm for the convention.
+        @dec0 : phase declination [radians]
+            default: None translates to the latitude of the observer
+        """
+        if dec0 is None:
+            dec0 = self.lat
+        ra = np.atleast_1d(ra)[:, np.newaxis]
+        dec = np.atleast_1d(dec)[:, np.newaxis]
+        sin_ra = np.sin(ra)
+        cos_ra = np.cos(ra)
+        cos_dec = np.cos(dec)
+
+        # angle-difference identities, so that the only trigonometry
+        # on the time axis is the cached sin_t and cos_t
+        sin_diff = self.sin_t * cos_ra - self.cos_t * sin_ra
+        cos_diff = cos_ra * self.cos_t + sin_ra * self.sin_t
+
+        l = cos_dec * sin_diff
+        m = cos_dec * np.sin(dec0) * cos_diff - \
+            np.sin(dec) * np.cos(dec0)
+        return l, m
+
+    def r_axis(self, ra, dec):
+        """
+        Convenience function for a single source:
+        return an N_t x 2 array whose rows are the (l, m) directions
+        expected by ant.phase_factor.
+        """
+        l, m = self.lm(ra, dec)
+        return np.stack((l[0], m[0]), axis=-1)
+
+# number of ObservationGeometry instances kept alive at once;
+# read on every call, so it may be changed at runtime
+GEOMETRY_CACHE_SIZE = 16
+
+_geometry_cache = collections.OrderedDict()
+
+def observation_geometry(t_axis, lat=None, radians=True):
+    """
+    Return the ObservationGeometry for the time axis
+        @t_axis : array of local sidereal times
+    and latitude
+        @lat (default: HERA array),
+    building it only on the first request for that (t_axis, lat) pair.
+    The GEOMETRY_CACHE_SIZE most recently used geometries are kept.
+    @radians classifies the units of @t_axis and @lat.
+    Unlike most functions here, this one defaults to radians,
+    because all of the simulation time axes are in radians.
+    """
+    t_axis = np.atleast_1d(np.asarray(t_axis, dtype=float))
+    key = (t_axis.tobytes(), lat, radians)
+    if key in _geometry_cache:
+        _geometry_cache.move_to_end(key)
+    else:
+        _geometry_cache[key] = ObservationGeometry(t_axis, lat, radians)
+    while len(_geometry_cache) > max(GEOMETRY_CACHE_SIZE, 1):
+        _geometry_cache.popitem(last=False)
+    return _geometry_cache[key]
+
 """
 We cannot put ra0 = get_lst() in the function header. Why?
 Because Python evaluates all function headers once upon first opening the script.
@@ -22,6 +22,8 @@ MACRO_EPSILON = 0.001
 from skyflux import stokes
 from skyflux import rot
 from skyflux import demo
+from skyflux import checkpoint
+from skyflux import store
 
 # we keep these as global parameters to avoid the potential overhead
 # of passing by value
@@ -29,6 +31,7 @@ nu_axis = None
 t_axis = None
 
 import time
+import multiprocessing
 
 """
     Yeah, this is not working. It ices the computer's memory!
@@ -54,18 +57,14 @@ def A_tensor(ra, dec):
     
     A_tensor = []
 
-    azs = []
-    alts = []
-    
-    for lst in t_axis:
-        #! We should definitely vectorize this
-        az, alt = rot.eq_to_topo(ra, dec, lst=lst, radians=True)
-        alts.append(alt)
-        azs.append(az)
+    # the rotation stack for t_axis is shared by every source
+    azs, alts = rot.observation_geometry(t_axis).topo(ra, dec)
+    azs = azs[0]
+    alts = alts[0]
 
     for nu in nu_axis:
         J_source = stokes.create_J(az=azs, alt=alts, nu=nu, radians=True)
-        A_source = np.array([stokes.create_A(J=J) for J in J_source])
+        A_source = stokes.create_A(J=J_source)
 
         A_tensor.append(np.array(A_source))
         
@@ -76,8 +75,8 @@ To-do:
     1. Saving routine: let us say that it saves our work for every
         frequency completed. That means that, if we crash,
         we lose only 17.21 minutes of work.
-        > Laziness bonus: we do not need to work on recovery mechanisms
-            (e.g. getting this function to *start* at an arbitrary point)
+        > Recovery: cold_tensor resumes from its checkpoint
+            (see skyflux.checkpoint) when rerun with the same parameters.
         Since the full tensor costs about 1.3 MB,
             it will be reasonable to simply save the whole tensor
             (rather than tracking exclusively new work),
@@ -92,7 +91,7 @@ To-do:
             You should calculate the magnitudes of the distances involved.
 """
 def cold_tensor(label, ant1, ant2,
-                start_index=0, end_index=3871, save_interval=4):
+                start_index=0, end_index=3871, save_interval=4, fmt="npz"):
     """
     Returns a giant block of visibility sums. Specifications:
         cold patch: 0 to 8 hours LST in 30 second increments
@@ -104,69 +103,223 @@ def cold_tensor(label, ant1, ant2,
     The third return value is the z-axis, also known as the data block.
         It describes the summed visibilities of all ~3000 catalog objects
         for a given time and frequency.
+    Every @save_interval sources, progress is checkpointed to
+        backup_<@label>.ckpt; rerunning with the same arguments
+        resumes from there. The result goes to backup_<@label>.npz,
+        or, for @fmt "hdf5" or "zarr", to the chunked store
+        backup_<@label>.h5 or backup_<@label>.zarr (see skyflux.store),
+        which is written as the simulation progresses.
     """
     global nu_axis
     global t_axis
     print("Unix time upon function call:", str(time.time()))
     
-    nu_axis = np.arange(50e6, 250e6 + MACRO_EPSILON, 1e6)
-    t_axis = np.arange(0, 2 * np.pi / 3 + MACRO_EPSILON, np.pi / 1440)
+    nu_axis, t_axis = cold_axes()
 
     v_tensor = np.zeros((len(nu_axis), len(t_axis), 4), dtype=np.complex128)
 
     cleaned = demo.cleaned_list()
 
+    # If a previous run with the same parameters died,
+    # we pick up where its last checkpoint left off.
+    ckpt = checkpoint.Checkpoint("backup_" + label + ".ckpt", {
+        'ant1' : ant1, 'ant2' : ant2,
+        'nu_axis' : nu_axis, 't_axis' : t_axis,
+        'start_index' : start_index, 'end_index' : end_index
+    }, interval=save_interval)
+    v_tensor = ckpt.resume(v_tensor)
+
     percent_interval = 100 / (end_index - start_index + 1)
-    percent = 0
+    percent = percent_interval * len(ckpt.done)
+
+    # A store is filled in as the simulation runs, a checkpoint's worth
+    # of sources at a time; a resumed run first rewrites it in full.
+    out = None
+    batch = None
+    batch_names = []
+    if fmt in store.extensions:
+        output = "backup_" + label + store.extensions[fmt]
+        out = store.create(output, [(ant1, ant2)], nu_axis, t_axis, label)
+        if ckpt.done:
+            out.write(v_tensor[np.newaxis])
+            out.add_sources(store.catalog_indices(sorted(ckpt.done)))
+        batch = np.zeros_like(v_tensor)
+    else:
+        output = "backup_" + label + ".npz"
 
-    unsaved_counter = 0
     i = start_index
     
     while i < end_index and i < len(cleaned):    
-        next_vt = []
         source = cleaned[i]
+        if source.name in ckpt.done:
+            i += 1
+            continue
         
         raI = np.radians(source.ra_angle)
         decI = np.radians(source.dec_angle)
         AI = A_tensor(raI, decI)
-
-        for ni in range(len(nu_axis)):
-            nu = nu_axis[ni]
-            next_vt.append([])
-
-            I = vis.get_I(source, nu)
-            s = np.array([complex(I), 0, 0, 0])
-
-            A_n = AI[ni]
-            
-            for ti in range(len(t_axis)):
-                t = t_axis[ti]
-
-                A = A_n[ti]
-                r = rot.radec2lm(raI, decI, ra0=t)
-                phi = ant.phase_factor(ant1, ant2, r, nu)
-
-                next_vista = np.dot(np.dot(A, s), phi)
-                next_vt[len(next_vt) - 1].append(next_vista)
-
-        v_tensor += np.array(next_vt)
+        r_axis = rot.observation_geometry(t_axis).r_axis(raI, decI)
+        s_axis = vis.stokes_axis(source, nu_axis)
+
+        # A . s for every frequency and time, then the phase factors
+        As = np.einsum('ftij,fj->fti', AI, s_axis)
+        phi = ant.array.phase_factors(
+            r_axis, nu_axis, pairs=[(ant1, ant2)])[0].T
+
+        next_tensor = As * phi[:, :, np.newaxis]
+        v_tensor += next_tensor
+        if out is not None:
+            batch += next_tensor
+            batch_names.append(source.name)
         
         percent += percent_interval
         percent_status = str(np.around(percent, 4))
         print("Visibility tensor: " + percent_status + \
               "% complete (finished i=" + str(i) + ").")
 
-        unsaved_counter += 1
-        if unsaved_counter > save_interval:
-            np.savez("backup_" + label, na=nu_axis, ta=t_axis, vt=v_tensor,
-                     dying_index=np.array(i))
-            unsaved_counter = 0
+        ckpt.update(v_tensor, source.name)
+
+        if len(batch_names) >= save_interval:
+            out.accumulate(batch[np.newaxis], coherent=True,
+                           sources=store.catalog_indices(batch_names))
+            batch[...] = 0
+            batch_names = []
 
         i += 1
 
-    np.savez("backup_" + label, na=nu_axis, ta=t_axis, vt=v_tensor,
-                     dying_index=np.array(-1))    
+    if out is not None:
+        if batch_names:
+            out.accumulate(batch[np.newaxis], coherent=True,
+                           sources=store.catalog_indices(batch_names))
+        out.close()
+    else:
+        np.savez(output, na=nu_axis, ta=t_axis, vt=v_tensor,
+                         dying_index=np.array(-1))
+
+    # the checkpoint is only dropped once the output is safely on disk
+    checkpoint.sync(output)
+    ckpt.finish(v_tensor)
+
+def cold_axes():
+    """
+    Return the frequency axis [Hz] and the LST axis [radians]
+    of the cold patch simulation (see cold_tensor).
+    """
+    nu_axis = np.arange(50e6, 250e6 + MACRO_EPSILON, 1e6)
+    t_axis = np.arange(0, 2 * np.pi / 3 + MACRO_EPSILON, np.pi / 1440)
+    return nu_axis, t_axis
+
+def _init_worker(nu_axis_, t_axis_):
+    """
+    Process pool initializer: record the simulation axes in
+    the worker and restrict its beam to the needed channels.
+    The spline parameters are memory-mapped (see stokes.load_sbf_params),
+    so all workers read the same pages rather than private copies.
+    """
+    global nu_axis
+    global t_axis
+    nu_axis = nu_axis_
+    t_axis = t_axis_
+    stokes.restrict_beam(nu_axis)
+
+def _shard_tensor(args):
+    """
+    Process pool task: return the shard's catalog indices
+    and their summed visibility tensor for the baseline
+    ant1 -> ant2, where @args = (ant1, ant2, shard indices).
+    """
+    ant1, ant2, shard = args
+    return shard, vis.visibilities(ant1, ant2, shard, t_axis, nu_axis)
+
+def parallel_cold_tensor(label, ant1, ant2,
+                         start_index=0, end_index=3871,
+                         processes=None, shards_per_process=4,
+                         fmt="npz"):
+    """
+    Multi-process version of cold_tensor. The cleaned catalog entries
+    [@start_index, @end_index) are split into shards, each shard's
+    partial visibility tensor is computed by a pool of @processes
+    workers (default: one per core), and the partial tensors are summed
+    in shard order, so that the result does not depend on scheduling.
+    Shards outnumber workers by @shards_per_process so that
+    a worker that finishes early picks up another shard.
+
+    The result is saved to backup_<@label>.npz, in the same format
+    as cold_tensor, and also returned as
+        nu_axis, t_axis, v_tensor
+    For @fmt "hdf5" or "zarr", it is instead saved to the chunked store
+    backup_<@label>.h5 or backup_<@label>.zarr (see skyflux.store),
+    to which each shard is added as soon as it is done.
+
+    Progress is checkpointed to backup_<@label>_parallel.ckpt after
+    every shard. Rerunning with the same arguments resumes from there,
+    sharding only the sources not yet done, so the number of
+    processes may change between runs.
+    """
+    print("Unix time upon function call:", str(time.time()))
 
+    nu_axis_, t_axis_ = cold_axes()
+    cleaned = catalog.query(valid_alpha=True)[start_index:end_index]
+
+    v_tensor = np.zeros((len(nu_axis_), len(t_axis_), 4),
+                        dtype=np.complex128)
+
+    # the sources done are recorded by catalog index
+    ckpt = checkpoint.Checkpoint("backup_" + label + "_parallel.ckpt", {
+        'ant1' : ant1, 'ant2' : ant2,
+        'nu_axis' : nu_axis_, 't_axis' : t_axis_,
+        'start_index' : start_index, 'end_index' : end_index
+    })
+    v_tensor = ckpt.resume(v_tensor)
+    remaining = np.array([i for i in cleaned if i not in ckpt.done],
+                         dtype=int)
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    num_shards = max(1, min(len(remaining), processes * shards_per_process))
+    tasks = [(ant1, ant2, shard)
+             for shard in np.array_split(remaining, num_shards)
+             if len(shard) > 0]
+
+    # Map the parameters before the pool starts, so that forked
+    # workers inherit the mapping instead of opening it again.
+    stokes.load_sbf_params()
+
+    out = None
+    if fmt in store.extensions:
+        output = "backup_" + label + store.extensions[fmt]
+        out = store.create(output, [(ant1, ant2)], nu_axis_, t_axis_, label)
+        if ckpt.done:
+            out.write(v_tensor[np.newaxis])
+            out.add_sources(sorted(ckpt.done))
+    else:
+        output = "backup_" + label + ".npz"
+
+    done = len(ckpt.done)
+    with multiprocessing.Pool(processes, initializer=_init_worker,
+                              initargs=(nu_axis_, t_axis_)) as pool:
+        # imap hands the shards back in order, so the floating-point
+        # sum is the same from run to run whatever the scheduling
+        for shard, partial in pool.imap(_shard_tensor, tasks):
+            v_tensor += partial
+            done += len(shard)
+            if out is not None:
+                out.accumulate(partial[np.newaxis], sources=shard,
+                               coherent=True)
+            ckpt.done.update(shard.tolist())
+            ckpt.save(v_tensor)
+            percent_status = str(np.around(100 * done / len(cleaned), 4))
+            print("Visibility tensor: " + percent_status + "% complete.")
+
+    if out is not None:
+        out.close()
+    else:
+        np.savez(output, na=nu_axis_, ta=t_axis_, vt=v_tensor,
+                 dying_index=np.array(-1))
+
+    checkpoint.sync(output)
+    ckpt.finish(v_tensor)
+    return nu_axis_, t_axis_, v_tensor
 
 ### Want to write a block that iterates over all possible baselines;
     # ignore duplicates?
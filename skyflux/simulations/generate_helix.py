@@ -8,6 +8,8 @@ from skyflux import vis
 from skyflux import stokes
 from skyflux import rot
 from skyflux import demo
+from skyflux import checkpoint
+from skyflux import store
 
 # disgustingly hacky
 MACRO_EPSILON = 0.001
@@ -37,22 +39,16 @@ def A_tensor(ra, dec):
     """
     A_tensor = []
 
-    azs = []
-    alts = []
-    
-    for t in t_axis:
-        #! We should definitely vectorize this
-        az, alt = rot.eq_to_topo(ra, dec, lst=t, radians=True)
-        alts.append(alt)
-        azs.append(az)
+    # the rotation stack for t_axis is shared by every source
+    azs, alts = rot.observation_geometry(t_axis).topo(ra, dec)
+    azs = azs[0]
+    alts = alts[0]
 
     for nu in nu_axis:
         J_source = stokes.create_J(
             az=azs, alt=alts, nu=nu, radians=True
         )
-        A_source = np.array(
-            [stokes.create_A(J=J) for J in J_source]
-        )
+        A_source = stokes.create_A(J=J_source)
 
         A_tensor.append(np.array(A_source))
         
@@ -66,25 +62,78 @@ def tick(percent):
 def null_source(obj):
     return obj.alpha != obj.alpha
     
-def multi_helix(ant1, ant2, sources=catalog.srcs):
+def multi_helix(ant1, ant2, sources=catalog.srcs, checkpoint_path=None,
+                save_interval=4, out=None):
+    """
+    Return the helix of the baseline @ant1 -> @ant2 summed over @sources.
+    If @checkpoint_path is given, progress is checkpointed there
+        every @save_interval sources, and a rerun with the same
+        baseline, sources and axes resumes from the last checkpoint.
+        The completed checkpoint is left in place: discard it
+        (see checkpoint.discard) once the helix has been saved.
+    If @out is given, an open single-baseline store (see store.create)
+        over the same axes, the sum is also written into it as the run
+        progresses: every @save_interval sources, those summed since
+        the last write are added to the store.
+        A resumed run first rewrites @out from the checkpoint,
+        so @out should be freshly created.
+    """
+    ckpt = None
+    if checkpoint_path is not None:
+        ckpt = checkpoint.Checkpoint(checkpoint_path, {
+            'ant1' : ant1, 'ant2' : ant2,
+            'nu_axis' : nu_axis, 't_axis' : t_axis,
+            'sources' : [obj.name for obj in sources]
+        }, interval=save_interval)
+
     percent_interval = 100 / len(sources)
     percent = 0
     
-    helix = single_helix(ant1, ant2, sources[0])
-    
-    percent += percent_interval
-    tick(percent)
-    
-    for next_obj in sources[1:]:
-        if null_source(next_obj):
+    helix = None if ckpt is None else ckpt.resume()
+    if helix is not None:
+        percent += percent_interval * len(ckpt.done)
+        if out is not None:
+            out.write(helix[np.newaxis])
+            out.add_sources(store.catalog_indices(sorted(ckpt.done)))
+
+    # sources summed since the last write to @out
+    batch = None
+    batch_names = []
+
+    for i, next_obj in enumerate(sources):
+        # the first source is always kept, as it seeds the helix
+        if i > 0 and null_source(next_obj):
+            continue
+        if ckpt is not None and next_obj.name in ckpt.done:
             continue
         
         next_helix = single_helix(ant1, ant2, next_obj)
-        helix = np.add(helix, next_helix)
+        if helix is None:
+            helix = next_helix
+        else:
+            helix = np.add(helix, next_helix)
+        if out is not None:
+            batch = next_helix if batch is None else \
+                np.add(batch, next_helix)
+            batch_names.append(next_obj.name)
         
         percent += percent_interval
         tick(percent)
-        
+
+        if ckpt is not None:
+            ckpt.update(helix, next_obj.name)
+
+        if batch is not None and len(batch_names) >= save_interval:
+            out.accumulate(batch[np.newaxis],
+                sources=store.catalog_indices(batch_names), coherent=True)
+            batch = None
+            batch_names = []
+
+    if batch is not None:
+        out.accumulate(batch[np.newaxis],
+            sources=store.catalog_indices(batch_names), coherent=True)
+    if ckpt is not None:
+        ckpt.finish(helix, remove=False)
     return helix
 
 def single_helix(ant1, ant2, source):
@@ -92,33 +141,17 @@ def single_helix(ant1, ant2, source):
     dec = np.radians(source.dec_angle)
     
     A_full = A_tensor(ra, dec)
+    r_axis = rot.observation_geometry(t_axis).r_axis(ra, dec)
 
-    s_axis = []
-        
-    f_layer = []
-    
-    for ni in nu_rl:
-        nu = nu_axis[ni]
-        
-        I = vis.get_I(source, nu)
-        s = np.array([complex(I), 0, 0, 0])
-        A_n = A_full[ni]
-
-        t_layer = []
-        for ti in t_rl:
-            t = t_axis[ti]
-
-            A_t = A_n[ti]
-            
-            r = rot.radec2lm(ra, dec, ra0=t)
-            phi = ant.phase_factor(ant1, ant2, r, nu)
-            
-            next_vista = np.dot(np.dot(A_t, s), phi)
-            t_layer.append(next_vista)
-  
-        f_layer.append(np.array(t_layer))
-
-    return np.array(f_layer)
+    s_axis = vis.stokes_axis(source, nu_axis)
+
+    # A . s for every frequency and time: |nu_axis| x |t_axis| x 4
+    As = np.einsum('ftij,fj->fti', A_full, s_axis)
+    # |t_axis| x |nu_axis| -> |nu_axis| x |t_axis|
+    phi = ant.array.phase_factors(
+        r_axis, nu_axis, pairs=[(ant1, ant2)])[0].T
+
+    return As * phi[:, :, np.newaxis]
     
 def package(block, ptitle):
     """
@@ -142,8 +175,29 @@ def pickle_dict(dict_, label):
     with open(label + '.pickle', 'wb') as handle:
         pickle.dump(dict_, handle, protocol=pickle.HIGHEST_PROTOCOL)
         
-def auto_helix(ant1, ant2, sources, label, ptitle):
-    pickle_dict(package(
-        multi_helix(ant1, ant2, sources), ptitle
-    ), label)
-    
+def auto_helix(ant1, ant2, sources, label, ptitle, fmt="pickle"):
+    """
+    Run multi_helix, checkpointing to <@label>.ckpt as it goes,
+    and save the result.
+    @fmt
+        "pickle": save to <@label>.pickle
+        "hdf5" or "zarr": save to the chunked store
+            <@label>.h5 or <@label>.zarr (see skyflux.store),
+            which is written as the simulation progresses
+    """
+    ckpt_path = label + ".ckpt"
+    if fmt in store.extensions:
+        # the store is filled in as the simulation runs
+        output = label + store.extensions[fmt]
+        with store.create(output, [(ant1, ant2)], nu_axis, t_axis,
+                          ptitle) as out:
+            multi_helix(ant1, ant2, sources, checkpoint_path=ckpt_path,
+                        out=out)
+    else:
+        helix = multi_helix(ant1, ant2, sources, checkpoint_path=ckpt_path)
+        pickle_dict(package(helix, ptitle), label)
+        output = label + ".pickle"
+
+    # the checkpoint is only dropped once the output is safely on disk
+    checkpoint.sync(output)
+    checkpoint.discard(ckpt_path)
@@ -1,3 +1,5 @@
+import contextlib
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pickle
@@ -9,6 +11,9 @@ from skyflux import stokes
 from skyflux import rot
 from skyflux import demo
 from skyflux import utils
+from skyflux import checkpoint
+from skyflux import wedge
+from skyflux import store
 
 # disgustingly hacky
 MACRO_EPSILON = 0.001
@@ -40,19 +45,15 @@ def A_tensor(ra, dec):
     """
     A_tensor = []
 
-    azs = []
-    alts = []
-    
-    for t in t_axis:
-        #! We should definitely vectorize this
-        az, alt = rot.eq_to_topo(ra, dec, lst=t, radians=True)
-        alts.append(alt)
-        azs.append(az)
+    # the rotation stack for t_axis is shared by every source
+    azs, alts = rot.observation_geometry(t_axis).topo(ra, dec)
+    azs = azs[0]
+    alts = alts[0]
 
     for nu in nu_axis:
         J_source = stokes.create_J(
             az=azs, alt=alts, nu=nu, radians=True)
-        A_source = np.array([stokes.create_A(J=J) for J in J_source])
+        A_source = stokes.create_A(J=J_source)
 
         A_tensor.append(np.array(A_source))
         
@@ -78,7 +79,7 @@ def f_only():
     for nu in nu_axis:
         J_source = stokes.create_J(
             az=az, alt=alt, nu=nu, radians=True)
-        A_source = stokes.create_A(J=J_source)
+        A_source = stokes.create_A(J=J_source)[0]
 
         A_tensor.append(np.array(A_source))
         
@@ -136,79 +137,148 @@ def tick(percent):
 def null_source(obj):
     return obj.alpha != obj.alpha
 
-def full_wedge(sources=catalog.srcs):
+def full_wedge(sources=catalog.srcs, checkpoint_path=None,
+               save_interval=4, coherent=False, out=None):
+    """
+    Return the wedge.Wedge summed over @sources
+        (as magnitudes, or as complex numbers if @coherent;
+        see merge_wedges), with one row per redundant group.
+        Both sums commute with expanding the groups,
+        so expansion is left to the output step.
+    If @checkpoint_path is given, progress is checkpointed there
+        every @save_interval sources, and a rerun with the same
+        sources and axes resumes from the last checkpoint.
+        The completed checkpoint is left in place: discard it
+        (see checkpoint.discard) once the wedge has been saved.
+    If @out is given, an open store (see store.create) over every
+        baseline and the same axes, the sum is also written into it
+        as the run progresses: every @save_interval sources, those
+        summed since the last write are added to the store.
+        The first write (of the checkpoint, for a resumed run)
+        overwrites @out, so @out should be freshly created.
+    """
+    ckpt = None
+    if checkpoint_path is not None:
+        ckpt = checkpoint.Checkpoint(checkpoint_path, {
+            'nu_axis' : nu_axis, 't_axis' : t_axis,
+            'sources' : [obj.name for obj in sources],
+            'coherent' : coherent
+        }, interval=save_interval)
+
     percent_interval = 100 / len(sources)
     percent = 0
-    
-    wedge = single_wedge(sources[0])
-    
-    percent += percent_interval
-    tick(percent)
-    
-    for next_obj in sources[1:]:
-        if null_source(next_obj):
-            continue
-        
-        next_wedge = single_wedge(next_obj)
-        wedge = merge_wedges(wedge, next_wedge)
 
-        percent += percent_interval
-        tick(percent)
-        
-    return wedge
+    block = None if ckpt is None else ckpt.resume()
+    if block is not None:
+        percent += percent_interval * len(ckpt.done)
+        if out is not None:
+            out.write_wedge(block)
+            out.add_sources(store.catalog_indices(sorted(ckpt.done)))
+
+    # sources summed since the last write to @out
+    batch = None
+    batch_names = []
+    # whether @out holds anything yet; until it does, it is overwritten
+    # rather than added to, since an incoherent sum would take the
+    # magnitude of a lone first batch
+    written = block is not None
+
+    # only the channels spanned by nu_axis need to be resident
+    with stokes.restrict_beam(nu_axis):
+        for i, next_obj in enumerate(sources):
+            # the first source is always kept, as it seeds the wedge
+            if i > 0 and null_source(next_obj):
+                continue
+            if ckpt is not None and next_obj.name in ckpt.done:
+                continue
+
+            next_wedge = single_wedge(next_obj)
+            if out is not None:
+                # the batch gets its own array, apart from the running sum
+                if batch is None:
+                    batch = next_wedge.copy()
+                else:
+                    merge_wedges(batch, next_wedge, coherent, in_place=True)
+                batch_names.append(next_obj.name)
 
-outer_ants = ant.ant_pos.copy()
+            if block is None:
+                block = next_wedge
+            else:
+                # each single_wedge is a fresh array, so the running
+                # sum can safely absorb it in place
+                merge_wedges(block, next_wedge, coherent, in_place=True)
 
-def single_wedge(source):
-    ra = np.radians(source.ra_angle)
-    dec = np.radians(source.dec_angle)
-    
-    A_full = A_tensor(ra, dec)
+            percent += percent_interval
+            tick(percent)
 
-    s_axis = []
+            if ckpt is not None:
+                ckpt.update(block, next_obj.name)
 
-    for ni in nu_rl:
-        nu = nu_axis[ni]
-        I = vis.get_I(source, nu)
-        s_axis.append(np.array([complex(I), 0, 0, 0]))
+            if batch is not None and len(batch_names) >= save_interval:
+                _write_batch(out, batch, batch_names, coherent, written)
+                written = True
+                batch = None
+                batch_names = []
 
-    for outer_ant in outer_ants.keys():
-        inner_ants = outer_ants.copy()
-        del inner_ants[outer_ant]
+    if batch is not None:
+        _write_batch(out, batch, batch_names, coherent, written)
+    if ckpt is not None:
+        ckpt.finish(block, remove=False)
+    return block
 
-        for inner_ant in inner_ants.keys():
-        
-            f_layer = []
-            for ni in nu_rl:
-                nu = nu_axis[ni]
-            
-                s = s_axis[ni]
-                A_n = A_full[ni]
+def _write_batch(out, batch, names, coherent, accumulate):
+    """
+    Write the wedge @batch, the sum over the sources called @names,
+    into the store @out: added to what @out holds if @accumulate
+    (see merge_wedges for @coherent), otherwise in its place.
+    """
+    sources = store.catalog_indices(names)
+    if accumulate:
+        out.accumulate_wedge(batch, sources, coherent)
+    else:
+        out.write_wedge(batch)
+        out.add_sources(sources)
+
+# HERA is highly redundant: baselines are grouped once per layout,
+# on first use, so that importing this module does not load the layout
+_redundancy = (None, None)
+
+def redundancy():
+    """
+    Return ant.array.redundancy() for the current layout.
+    """
+    global _redundancy
+    if _redundancy[0] is not ant.array:
+        _redundancy = (ant.array, ant.array.redundancy())
+    return _redundancy[1]
 
-                t_layer = []
-                for ti in t_rl:
-                    t = t_axis[ti]
+def single_wedge(source):
+    """
+    Return the wedge.Wedge of a single @source over nu_axis and t_axis,
+    with one row per redundant group of baselines
+    (see wedge.Wedge.expand for the full set).
+    """
+    ra = np.radians(source.ra_angle)
+    dec = np.radians(source.dec_angle)
+    
+    A_full = A_tensor(ra, dec)
+    r_axis = rot.observation_geometry(t_axis).r_axis(ra, dec)
 
-                    r = rot.radec2lm(ra, dec, ra0=t)
-                    phi = ant.phase_factor(
-                        outer_ant, inner_ant, r, nu)
-                    
-                    A_t = A_n[ti]
-                    
-                    next_vista = np.dot(np.dot(A_t, s), phi)
-                    t_layer.append(next_vista)
-          
-                t_layer = np.array(t_layer)
-                
-                f_layer.append(t_layer)
+    s_axis = vis.stokes_axis(source, nu_axis)
 
-            f_layer = np.array(f_layer)
+    # A . s for every frequency and time: |nu_axis| x |t_axis| x 4
+    As = np.einsum('ftij,fj->fti', A_full, s_axis)
 
-            inner_ants[inner_ant] = f_layer
-            
-        outer_ants[outer_ant] = inner_ants
+    # Phase factors of one baseline per redundant group:
+    # N_red x |t_axis| x |nu_axis|
+    unique_pairs, group, conjugated = redundancy()
+    phases = ant.array.phase_factors(r_axis, nu_axis, unique_pairs)
 
-    return outer_ants
+    # N_red x |nu_axis| x |t_axis| x 4
+    data = As[np.newaxis] * \
+        np.swapaxes(phases, 1, 2)[:, :, :, np.newaxis]
+    return wedge.Wedge(unique_pairs, nu_axis, t_axis, data,
+                       redundancy=(ant.array.pairs(), group, conjugated))
     
 def single_wedge_readout(source):
     """
@@ -223,16 +293,13 @@ def single_wedge_readout(source):
     dec = np.radians(source.dec_angle)
     
     A_full = A_tensor(ra, dec)
+    r_axis = rot.observation_geometry(t_axis).r_axis(ra, dec)
 
-    s_axis = []
+    s_axis = vis.stokes_axis(source, nu_axis)
 
     kill_timer = 0
-    
-    for ni in nu_rl:
-        nu = nu_axis[ni]
-        I = vis.get_I(source, nu)
-        s_axis.append(np.array([complex(I), 0, 0, 0]))
 
+    outer_ants = ant.ant_pos.copy()
     for outer_ant in outer_ants.keys():
         inner_ants = outer_ants.copy()
         del inner_ants[outer_ant]
@@ -250,7 +317,7 @@ def single_wedge_readout(source):
                 for ti in t_rl:
                     t = t_axis[ti]
 
-                    r = rot.radec2lm(ra, dec, ra0=t)
+                    r = r_axis[ti]
                     phi = ant.phase_factor(
                         outer_ant, inner_ant, r, nu)
                     
@@ -291,16 +358,13 @@ def single_wedge_spot(source, ti):
     dec = np.radians(source.dec_angle)
     
     A_full = A_tensor(ra, dec)
+    r_axis = rot.observation_geometry(t_axis).r_axis(ra, dec)
 
-    s_axis = []
-    
-    for ni in nu_rl:
-        nu = nu_axis[ni]
-        I = vis.get_I(source, nu)
-        s_axis.append(np.array([complex(I), 0, 0, 0]))
+    s_axis = vis.stokes_axis(source, nu_axis)
 
     kill_timer = 0
    
+    outer_ants = ant.ant_pos.copy()
     for outer_ant in outer_ants.keys():
         inner_ants = outer_ants.copy()
         del inner_ants[outer_ant]
@@ -318,7 +382,7 @@ def single_wedge_spot(source, ti):
                 
                 t = t_axis[ti[kill_timer]]
 
-                r = rot.radec2lm(ra, dec, ra0=t)
+                r = r_axis[ti[kill_timer]]
                 phi = ant.phase_factor(
                     outer_ant, inner_ant, r, nu)
                 
@@ -439,63 +503,129 @@ def single_wedge_spot(source, ti):
 
     return outer_ants
     
-def merge_wedges(wedge1, wedge2):
+def merge_wedges(wedge1, wedge2, coherent=False, in_place=False):
     """ We assume that both wedges have the same format:
-        ant1, ant2, nu, t hierarchies are exactly the same.
+        baselines, frequencies and times are exactly the same.
+
+    @coherent
+        False: we don't care about parameter phases, so we sum
+            magnitudes, and phases do not produce spurious
+            interference patterns
+        True: complex sum
+    @in_place
+        True: accumulate into (and return) @wedge1
+        False: leave both inputs untouched
     """
-    sum_ = {}
-    for ant1 in wedge1.keys():
-        sum_[ant1] = {}
-        for ant2 in wedge1[ant1].keys():
-            sum_[ant1][ant2] = np.zeros(
-                (len(nu_rl), len(t_rl), 4), dtype=np.complex128
-            )
-            for nu_idx in nu_rl:
-                for t_idx in t_rl:
-                    
-                    vis1 = wedge1[ant1][ant2][nu_idx][t_idx]
-                    vis2 = wedge2[ant1][ant2][nu_idx][t_idx]
-
-                    # We don't care about parameter phases
-                    # and we take abs so that phases do not
-                    # produce spurious interference patterns
-                    for i in range(len(vis1)):
-                        vis1[i] = np.abs(vis1[i])
-                        vis2[i] = np.abs(vis2[i])
-
-                    sum_[ant1][ant2][nu_idx][t_idx] = \
-                        np.add(vis1, vis2)
-                        
-    return sum_
-    
-def merge_files(fname1, fname2, new_fname, new_ptitle):
+    if not in_place:
+        wedge1 = wedge1.copy()
+    return wedge1.accumulate(wedge2, coherent)
+
+# number of baselines read, summed and written at a time by merge_files
+MERGE_BLOCK = 64
+
+def merge_files(fname1, fname2, new_fname, new_ptitle, coherent=False):
     """ This function only really makes sense if f1 and f2 
         have common simulation parameters
             (frequency res, time res, etc)
+
+    Wedges saved with wedge.save, and stores (paths ending in
+    .h5, .hdf5 or .zarr; see skyflux.store), are merged in streaming
+    fashion, MERGE_BLOCK baselines at a time, straight from and to disk.
+    If @new_fname is one of the inputs, that input is updated in place.
+    Pickled wedges are necessarily loaded whole, but the second
+    is accumulated into the first rather than into a third copy.
     """
-    f1 = open(fname1 + ".pickle", "rb")
-    f2 = open(fname2 + ".pickle", "rb")
-    
-    sim1 = pickle.load(f1)
-    sim2 = pickle.load(f2)
-    
-    # arbitrarily take common sim. parameters from f1
-    fs = sim1['frequencies']
-    ts = sim1['times']
+    if store.is_store(fname1) and store.is_store(fname2):
+        merge_stores(fname1, fname2, new_fname, new_ptitle, coherent)
+        return
+    if store.is_store(fname1) or store.is_store(fname2):
+        raise ValueError("A store can only be merged with another store.")
+    if wedge.saved(fname1) and wedge.saved(fname2):
+        merge_saved(fname1, fname2, new_fname, new_ptitle, coherent)
+        return
+
+    with open(fname1 + ".pickle", "rb") as f1:
+        wedge1 = wedge.unpackage(pickle.load(f1))
+    with open(fname2 + ".pickle", "rb") as f2:
+        wedge2 = wedge.unpackage(pickle.load(f2))
     
-    # merge the wedges
-    wedge1 = sim1['picture']
-    wedge2 = sim2['picture']
-    wmerged = merge_wedges(wedge1, wedge2)
-    
-    packed = {
-        'frequencies' : fs,
-        'times' : ts,
-        'picture' : wmerged,
-        'title' : new_ptitle
-    }
-    utils.pickle_dict(packed, new_fname)
+    # common sim. parameters are taken from f1
+    merge_wedges(wedge1, wedge2, coherent, in_place=True)
+    del wedge2
     
+    utils.pickle_dict(wedge.package(wedge1, new_ptitle), new_fname)
+
+def merge_saved(fname1, fname2, new_fname, new_ptitle, coherent=False):
+    """
+    Streaming counterpart of merge_files for wedges saved
+    as memory-mappable directories (see wedge.save).
+    """
+    # both merge modes are symmetric, so if the output overwrites
+    # an input, we accumulate the other input into that one
+    if new_fname in (fname1, fname2):
+        other_fname = fname2 if new_fname == fname1 else fname1
+        target, _ = wedge.load(new_fname, mmap_mode='r+')
+        first = None
+        wedge.set_title(new_fname, new_ptitle)
+    else:
+        other_fname = fname2
+        first, _ = wedge.load(fname1, mmap_mode='r')
+        target = wedge.create(new_fname, first.pairs, first.frequencies,
+                              first.times, new_ptitle)
+    other, _ = wedge.load(other_fname, mmap_mode='r')
+
+    if not target.compatible(other):
+        raise ValueError("Wedges with different baselines," + \
+            " frequencies or times cannot be merged.")
+
+    for start in range(0, len(target), MERGE_BLOCK):
+        rows = slice(start, start + MERGE_BLOCK)
+        if first is not None:
+            target.data[rows] = first.data[rows]
+        wedge.accumulate(target.data[rows], other.data[rows], coherent)
+    target.data.flush()
+
+def merge_stores(fname1, fname2, new_fname, new_ptitle, coherent=False):
+    """
+    Streaming counterpart of merge_files for stores
+    (see skyflux.store). The merged store records the sources
+    of both inputs.
+    """
+    # as in merge_saved, an output that overwrites an input
+    # absorbs the other input
+    in_place = new_fname in (fname1, fname2)
+    if in_place:
+        first_fname = new_fname
+        other_fname = fname2 if new_fname == fname1 else fname1
+    else:
+        first_fname, other_fname = fname1, fname2
+
+    with store.open_store(first_fname, "r+" if in_place else "r") as first, \
+         store.open_store(other_fname) as other:
+        # nothing is created or retitled until the inputs are known to fit
+        if not store.compatible(first, other):
+            raise ValueError("Stores with different baselines," + \
+                " frequencies or times cannot be merged.")
+
+        if in_place:
+            first.title = new_ptitle
+            output = contextlib.nullcontext(first)
+        else:
+            output = store.create(new_fname, first.baselines,
+                                  first.frequencies, first.times, new_ptitle)
+
+        with output as target:
+            for start in range(0, len(target.baselines), MERGE_BLOCK):
+                rows = slice(start, start + MERGE_BLOCK)
+                if target is not first:
+                    target.write(first.visibilities[rows], rows=rows)
+                target.accumulate(other.visibilities[rows], rows,
+                                  coherent=coherent)
+
+            if target is not first:
+                target.add_sources(first.sources)
+            target.add_sources(other.sources)
+
 def package(block, ptitle):
     """
     Returns a print-ready dictionary,
@@ -503,19 +633,39 @@ def package(block, ptitle):
         
     Use pickle_dict to save to disk.
     """
-    return {'frequencies' : nu_axis,
-            'times' : t_axis,
-            'picture' : block,
-            'title' : ptitle}
+    return wedge.package(block, ptitle)
         
-def auto_wedge(list_sources, label, ptitle):
+def auto_wedge(list_sources, label, ptitle, fmt="pickle"):
     """
     Automatically runs
         full_wedge(list_sources)
         package_wedge()
         pickle_dict
+    checkpointing to <@label>.ckpt as it goes.
+    @fmt
+        "pickle": save to <@label>.pickle
+        "wedge": save to the memory-mappable <@label>.wedge/
+            (see wedge.save), which merge_files can stream
+        "hdf5" or "zarr": save to the chunked store
+            <@label>.h5 or <@label>.zarr (see skyflux.store),
+            which is written as the simulation progresses
     """
-    utils.pickle_dict(package(
-        full_wedge(list_sources), ptitle
-    ), label)
-    
+    ckpt_path = label + ".ckpt"
+    if fmt in store.extensions:
+        # the store is filled in as the simulation runs
+        output = label + store.extensions[fmt]
+        with store.create(output, ant.array.pairs(), nu_axis, t_axis,
+                          ptitle) as out:
+            full_wedge(list_sources, checkpoint_path=ckpt_path, out=out)
+    else:
+        block = full_wedge(list_sources, checkpoint_path=ckpt_path)
+        if fmt == "wedge":
+            wedge.save(block, label, ptitle)
+            output = label + ".wedge"
+        else:
+            utils.pickle_dict(package(block, ptitle), label)
+            output = label + ".pickle"
+
+    # the checkpoint is only dropped once the output is safely on disk
+    checkpoint.sync(output)
+    checkpoint.discard(ckpt_path)
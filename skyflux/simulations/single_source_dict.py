@@ -52,18 +52,14 @@ def A_tensor():
     
     A_tensor = []
 
-    azs = []
-    alts = []
-    
-    for lst in t_axis:
-        #! We should definitely vectorize this
-        az, alt = rot.eq_to_topo(ra, dec, lst=lst, radians=True)
-        alts.append(alt)
-        azs.append(az)
+    # the rotation stack for t_axis is shared by every source
+    azs, alts = rot.observation_geometry(t_axis).topo(ra, dec)
+    azs = azs[0]
+    alts = alts[0]
 
     for nu in nu_axis:
         J_source = stokes.create_J(az=azs, alt=alts, nu=nu, radians=True)
-        A_source = np.array([stokes.create_A(J=J) for J in J_source])
+        A_source = stokes.create_A(J=J_source)
 
         A_tensor.append(np.array(A_source))
         
@@ -92,7 +88,7 @@ def f_only():
 
     for nu in nu_axis:
         J_source = stokes.create_J(az=az, alt=alt, nu=nu, radians=True)
-        A_source = stokes.create_A(J=J_source)
+        A_source = stokes.create_A(J=J_source)[0]
 
         A_tensor.append(np.array(A_source))
         
@@ -128,28 +124,20 @@ def picture_tensor():
 
     print("\nFinished building s-vector vector.\n")
 
-    ants = ant.ant_pos.copy()
-    outer_ants = ants.copy()
-    
-    for outer_ant in outer_ants.keys():
-        inner_ants = ants.copy()
-        del inner_ants[outer_ant]
-
-        for inner_ant in inner_ants.keys():
-        
-            phi = ant.phase_factor(outer_ant, inner_ant, r, nu)
-        
-            next_vt = []
-            for ni in range(len(nu_axis)):
-                s = s_axis[ni]
-                A_n = A[ni]
+    # A . s for every frequency: |nu_axis| x 4
+    As = np.einsum('fij,fj->fi', A, np.array(s_axis))
 
-                next_vista = np.dot(np.dot(A_n, s), phi)
-                next_vt.append(next_vista)
+    # HERA is highly redundant, so only one baseline per redundant
+    # group is computed: N_red x |nu_axis| x 4
+    unique_pairs, group, conjugated = ant.array.redundancy()
+    phases = ant.array.phase_factors(np.array(r), nu_axis, unique_pairs)
+    vt = As[np.newaxis] * phases[:, :, np.newaxis]
 
-            inner_ants[inner_ant] = next_vt
-
-        outer_ants[outer_ant] = inner_ants
+    # every ordered baseline, only for the output
+    vt = ant.expand_redundant(vt, group, conjugated)
+    outer_ants = {}
+    for b, (outer_ant, inner_ant) in enumerate(ant.array.pairs().tolist()):
+        outer_ants.setdefault(outer_ant, {})[inner_ant] = vt[b]
 
     return outer_ants
 
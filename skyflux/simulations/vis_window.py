@@ -36,17 +36,13 @@ def A_tensor(ra, dec, nu):
     """
     A_tensor = []
 
-    azs = []
-    alts = []
-    
-    for t in t_axis:
-        #! We should definitely vectorize this
-        az, alt = rot.eq_to_topo(ra, dec, lst=t, radians=True)
-        alts.append(alt)
-        azs.append(az)
+    # the rotation stack for t_axis is shared by every source
+    azs, alts = rot.observation_geometry(t_axis).topo(ra, dec)
+    azs = azs[0]
+    alts = alts[0]
 
     J_source = stokes.create_J(az=azs, alt=alts, nu=nu, radians=True)
-    A_source = np.array([stokes.create_A(J=J) for J in J_source])
+    A_source = stokes.create_A(J=J_source)
         
     return np.array(A_source)
                    
@@ -66,6 +62,7 @@ def fwhm(ant1, ant2, source, nu, max_):
     dec = np.radians(source.dec_angle)
     
     A_n = A_tensor(ra, dec, nu)
+    r_axis = rot.observation_geometry(t_axis).r_axis(ra, dec)
 
     s_axis = []
         
@@ -84,7 +81,7 @@ def fwhm(ant1, ant2, source, nu, max_):
 
         A_t = A_n[ti]
         
-        r = rot.radec2lm(ra, dec, ra0=t)
+        r = r_axis[ti]
         phi = ant.phase_factor(ant1, ant2, r, nu)
         
         next_vista = np.dot(np.dot(A_t, s), phi)
@@ -124,6 +121,7 @@ def vmax(ant1, ant2, source, nu):
     dec = np.radians(source.dec_angle)
     
     A_n = A_tensor(ra, dec, nu)
+    r_axis = rot.observation_geometry(t_axis).r_axis(ra, dec)
 
     s_axis = []
         
@@ -139,7 +137,7 @@ def vmax(ant1, ant2, source, nu):
 
         A_t = A_n[ti]
         
-        r = rot.radec2lm(ra, dec, ra0=t)
+        r = r_axis[ti]
         phi = ant.phase_factor(ant1, ant2, r, nu)
         
         next_vista = np.dot(np.dot(A_t, s), phi)
@@ -152,6 +150,8 @@ def vmax(ant1, ant2, source, nu):
     return max_
     
 def find_window(ant1, ant2, source, nu):
-    m = vmax(ant1, ant2, source, nu)
-    fwhm(ant1, ant2, source, nu, m)
+    # we only ever need the beam at the one frequency
+    with stokes.restrict_beam(nu):
+        m = vmax(ant1, ant2, source, nu)
+        fwhm(ant1, ant2, source, nu, m)
     
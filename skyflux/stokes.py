@@ -1,36 +1,247 @@
 import os
+import collections
 
 import numpy as np
 import healpy as hp
 
-from RIMEz import beam_models
-
 from skyflux import utils
 from skyflux import rot
 
 """!
-This file is 840 MB. There's no way that's going to fly.
-At the same time, there is no denying that we have
-shaved a couple of seconds off of the import time...
+The legacy sbf_params.npy file is 840 MB of pickled objects,
+so loading it at import time cost seconds and nearly 1 GB of RAM
+for every process, even those that never touch the beam.
+Now nothing is read until the beam is first evaluated. If the
+spline parameters have been converted (see convert_sbf_params) into
+the plain-array directory sbf_params/, they are memory-mapped,
+so concurrent processes share the same pages of the page cache.
 !"""
 sbfps_origin = os.path.dirname(os.path.abspath(__file__)) + \
               "/sbf_params.npy"
+sbfps_dir = os.path.dirname(os.path.abspath(__file__)) + \
+              "/sbf_params/"
+
+# The order matches beam_models.construct_spline_beam_func
+# and the legacy pickled array.
+sbf_param_names = ["nu_axis", "tx", "ty", "kx", "ky",
+                   "E_coeffs", "rE_coeffs"]
+
+_sbf_params = None
+_spline_beam_func = None
+
+# indices into the full beam frequency axis to which the
+# beam model is restricted; None means every channel
+_beam_channels = None
+
+# number of single-channel beam evaluators kept alive at once;
+# read on every call, so it may be changed at runtime
+BEAM_CACHE_SIZE = 8
+
+def convert_sbf_params(origin=sbfps_origin, destination=sbfps_dir):
+    """
+    One-time conversion of the pickled spline beam parameters
+    at @origin into one non-pickled .npy file per parameter
+    inside the directory @destination, which load_sbf_params
+    can then memory-map.
+    """
+    sbfps = np.load(origin, allow_pickle=True)
+    os.makedirs(destination, exist_ok=True)
+    for name, param in zip(sbf_param_names, sbfps):
+        np.save(destination + name + ".npy", np.asarray(param),
+                allow_pickle=False)
+
+def load_sbf_params():
+    """
+    Return the list of spline beam parameters, in the order of
+    sbf_param_names, reading them from disk only on the first call.
+    The memory-mappable directory format is preferred; the legacy
+    pickled file is the fallback.
+    """
+    global _sbf_params
+    if _sbf_params is not None:
+        return _sbf_params
+
+    if os.path.isdir(sbfps_dir):
+        # np.asarray strips the memmap subclass (which numba
+        # does not accept) while keeping the mapped buffer
+        _sbf_params = [np.asarray(np.load(
+            sbfps_dir + name + ".npy", mmap_mode='r', allow_pickle=False
+        )) for name in sbf_param_names]
+    else:
+        sbfps = np.load(sbfps_origin, allow_pickle=True)
+        _sbf_params = [sbfps[i] for i in range(len(sbf_param_names))]
+        del sbfps
+    return _sbf_params
+
+def channel_params(indices):
+    """
+    Return the spline beam parameters restricted to the beam channels
+    at @indices (into the full beam frequency axis).
+    The knots (tx, ty) and degrees (kx, ky) are common to all channels;
+    the coefficient arrays carry frequency on their leading axis.
+    Because the full parameters are memory-mapped when possible,
+    only the selected channels are ever read into RAM.
+    """
+    nu_axis, tx, ty, kx, ky, E_coeffs, rE_coeffs = load_sbf_params()
+    indices = np.atleast_1d(indices)
+    if np.all(np.diff(indices) == 1):
+        # A run of consecutive channels is a slice, which stays a view
+        # of the mapped file: processes sharing the beam then also
+        # share its pages instead of each holding a private copy.
+        indices = slice(indices[0], indices[-1] + 1)
+    return [np.ascontiguousarray(nu_axis[indices]), tx, ty, kx, ky,
+            np.ascontiguousarray(E_coeffs[indices]),
+            np.ascontiguousarray(rE_coeffs[indices])]
+
+class _BeamRestriction:
+    """
+    Returned by restrict_beam. Used as a context manager,
+    it puts back the restriction that was in force before.
+    """
+    def __init__(self, previous):
+        self.previous = previous
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.restore()
+
+    def restore(self):
+        """
+        Reinstate the restriction (and any spline beam function
+        already built for it) that preceded this one.
+        """
+        global _beam_channels
+        global _spline_beam_func
+        _beam_channels, _spline_beam_func = self.previous
+
+def restrict_beam(frqs=None):
+    """
+    Restrict the beam model to the beam channels needed for
+    the frequencies @frqs [Hz], i.e. every channel inside
+    [min(@frqs), max(@frqs)], widened to the nearest beam channel
+    on either side wherever an endpoint is not itself a beam channel.
+    Subsequent calls to spline_beam_func only ever build splines over
+    this subset, so a narrow-band job keeps a fraction of the beam in memory.
+
+    @frqs = None lifts the restriction.
+
+    The restriction applies to the whole module (get_beam_frqs and
+    every beam evaluation), so prefer the context manager form,
+        with stokes.restrict_beam(nu_axis):
+            ...
+    which reinstates the previous restriction on exit.
+    """
+    global _beam_channels
+    global _spline_beam_func
+
+    restriction = _BeamRestriction((_beam_channels, _spline_beam_func))
+
+    if frqs is None:
+        channels = None
+    else:
+        all_frqs = load_sbf_params()[0]
+        frqs = np.atleast_1d(frqs)
+        lo = max(np.searchsorted(all_frqs, frqs.min(), side='right') - 1, 0)
+        hi = min(np.searchsorted(all_frqs, frqs.max(), side='left') + 1,
+                 len(all_frqs))
+        channels = np.arange(lo, hi)
+
+    # keep the existing evaluators if nothing has changed
+    if channels is None and _beam_channels is None:
+        return restriction
+    if channels is not None and _beam_channels is not None and \
+       np.array_equal(channels, _beam_channels):
+        return restriction
+
+    _beam_channels = channels
+    _spline_beam_func = None
+    return restriction
+
+def get_beam_frqs():
+    """
+    Return the array of frequencies [Hz] at which the beam is defined,
+    honoring any restriction established by restrict_beam.
+    """
+    all_frqs = load_sbf_params()[0]
+    if _beam_channels is None:
+        return all_frqs
+    return all_frqs[_beam_channels]
+
+def _construct(params):
+    # RIMEz (and numba with it) is also slow to import,
+    # so we defer it along with the parameters.
+    from RIMEz import beam_models
+    return beam_models.construct_spline_beam_func(*params)
+
+def get_spline_beam_func():
+    """
+    Return the RIMEz spline beam function over every available channel
+    (see restrict_beam), constructing it on the first call.
+    """
+    global _spline_beam_func
+    if _spline_beam_func is None:
+        if _beam_channels is None:
+            _spline_beam_func = _construct(load_sbf_params())
+        else:
+            _spline_beam_func = _construct(channel_params(_beam_channels))
+    return _spline_beam_func
 
-sbfps = np.load(sbfps_origin, allow_pickle=True)
+_channel_beam_funcs = collections.OrderedDict()
 
-beam_frqs = sbfps[0].copy()
+def channel_beam_func(nu):
+    """
+    Return a spline beam function built over the single beam channel
+    @nu [Hz], which must be one of the beam frequencies.
+    The BEAM_CACHE_SIZE most recently used channels are kept,
+    or every channel of the restriction if that is larger
+    (see restrict_beam), since a job sweeps its whole band
+    once per source; older ones are released along with
+    their coefficients.
+    """
+    nu = float(nu)
+    if nu in _channel_beam_funcs:
+        _channel_beam_funcs.move_to_end(nu)
+        return _channel_beam_funcs[nu]
+
+    all_frqs = load_sbf_params()[0]
+    index = np.flatnonzero(all_frqs == nu)
+    if len(index) == 0:
+        raise ValueError(str(nu) + " Hz is not a beam frequency.")
+    _channel_beam_funcs[nu] = _construct(channel_params(index))
+
+    capacity = max(BEAM_CACHE_SIZE, 1)
+    if _beam_channels is not None:
+        capacity = max(capacity, len(_beam_channels))
+    while len(_channel_beam_funcs) > capacity:
+        _channel_beam_funcs.popitem(last=False)
+    return _channel_beam_funcs[nu]
+
+def spline_beam_func(nu, alt, az):
+    """
+    Evaluate the RIMEz spline beam at frequency @nu [Hz]
+    and topocentric position (@alt, @az) [radians].
+    The output has the RIMEz ordering; see format_J.
 
-spline_beam_func = beam_models.construct_spline_beam_func(
-    beam_frqs, sbfps[1], sbfps[2], sbfps[3],
-    sbfps[4], sbfps[5], sbfps[6])
+    While the beam is restricted (see restrict_beam), a single
+    frequency is served by its own cached single-channel evaluator.
+    """
+    if _beam_channels is not None and np.ndim(nu) == 0:
+        return channel_beam_func(float(nu))(nu, alt, az)
+    return get_spline_beam_func()(nu, alt, az)
 
-del sbfps
-    # I do not know how to clear the ~840 MB out of RAM
-    # It appears that spline_beam_func takes up that amount of space in RAM)
+def __getattr__(name):
+    # Module-level attribute hook (PEP 562), so that
+    # stokes.beam_frqs keeps working without an eager load.
+    if name == "beam_frqs":
+        return get_beam_frqs()
+    raise AttributeError(
+        "module " + repr(__name__) + " has no attribute " + repr(name))
 
 ### end of importing/loading ###
 
-def format_J(J_RIMEz):
+def format_J(J_RIMEz, copy=True):
     """
     The default shape of a single RIMEz J matrix is:
         [[xy, yy], [xx, yx]]
@@ -39,12 +250,19 @@ def format_J(J_RIMEz):
     As with np.radians, one must verify that the input is of
     the incorrect format. For example, if one called this on
     a hard-coded J matrix, one would merely confuse the order.
+
+    @J_RIMEz may be a single 2 x 2 matrix or any (..., 2, 2) stack.
+    @copy
+        True: return a new, contiguous array
+        False: return a view of @J_RIMEz; no data is moved,
+            but writing to the result writes to @J_RIMEz
     """
-    new_J = np.copy(J_RIMEz)
-    for i in range(len(new_J)):
-        new_J[i, 0, 0], new_J[i, 1, 0], new_J[i, 0, 1], new_J[i, 1, 1] = \
-        new_J[i, 0, 1], new_J[i, 0, 0], new_J[i, 1, 1], new_J[i, 1, 0]
-    return new_J
+    # conventional[a, b] = RIMEz[b, 1 - a]:
+    # a transposition followed by a flip of the row axis
+    J = np.swapaxes(J_RIMEz, -1, -2)[..., ::-1, :]
+    if copy:
+        return np.array(J)
+    return J
 
 # This is a constant change of basis matrix
 # for getting stokes parameters with a Jones matrix.
@@ -54,8 +272,64 @@ S = .5 * np.array([[1, 1, 0, 0,],
                   [1, -1, 0, 0]])
 Si = np.linalg.inv(S)
 
+def interpolate_beam(nu, alt, az):
+    """
+    Evaluate the spline beam at arbitrary frequencies @nu [Hz]
+    within the span of the beam frequencies, by linear interpolation
+    of the Jones values of the two bracketing beam channels.
+    Each beam channel is evaluated at most once, however many
+    of the requested frequencies fall next to it.
+
+    @nu: float, or array of length N_nu
+    @alt, @az: topocentric positions [radians], arrays of length N_pos
+
+    Returns an N_pos x 2 x 2 stack for a float @nu,
+    or an N_nu x N_pos x 2 x 2 stack for an array @nu,
+    in the RIMEz ordering (see format_J).
+    """
+    frqs = get_beam_frqs()
+    nus = np.atleast_1d(np.asarray(nu, dtype=float))
+
+    if nus.min() < frqs[0] or nus.max() > frqs[-1]:
+        raise ValueError("Cannot extrapolate the beam beyond " + \
+            str(frqs[0]) + " to " + str(frqs[-1]) + " Hz.")
+
+    if np.ndim(nu) == 0 and nus[0] in frqs:
+        return spline_beam_func(nus[0], alt, az)
+
+    # the first beam channel at or above each frequency
+    k = np.minimum(np.searchsorted(frqs, nus), len(frqs) - 1)
+
+    # Frequencies on a beam channel need only that channel.
+    # This also covers a beam restricted to a single channel,
+    # where there is no pair of channels to interpolate between.
+    lo = k.copy()
+    hi = k.copy()
+    weight = np.zeros(len(nus))
+
+    # Any other frequency lies strictly between two channels,
+    # so 1 <= k <= len(frqs) - 1 for these.
+    between = frqs[k] != nus
+    lo[between] = k[between] - 1
+    weight[between] = (nus[between] - frqs[lo[between]]) / \
+        (frqs[hi[between]] - frqs[lo[between]])
+
+    channels = np.unique(np.concatenate((lo, hi)))
+    J_channels = np.array([
+        spline_beam_func(frqs[k], alt, az) for k in channels
+    ])
+
+    w = weight[:, np.newaxis, np.newaxis, np.newaxis]
+    J = (1 - w) * J_channels[np.searchsorted(channels, lo)] + \
+        w * J_channels[np.searchsorted(channels, hi)]
+
+    if np.ndim(nu) == 0:
+        return J[0]
+    return J
+
 def create_J(ra=None, dec=None, az=None, alt=None,
-             lat=None, lst=None, nu=151e6, radians=False):
+             lat=None, lst=None, nu=151e6, radians=False,
+             interpolate=True):
     """
     Return the Jones matrix J.
     @ra: right ascension of the source, in radians.
@@ -69,17 +343,25 @@ def create_J(ra=None, dec=None, az=None, alt=None,
         default: 151 MHz
     The default argument comes from the beam that I
     had access to when this was written.
+    If @nu is an array, the result gains a leading frequency axis.
+
+    @interpolate
+        True: frequencies between beam channels are served
+            by interpolate_beam
+        False: only exact beam frequencies are accepted
     """
     # This section handles the many possible bad combinations of inputs
     if type(nu) == list:
-        nu = np.array(list)
+        nu = np.array(nu)
     
-    if type(nu) == np.ndarray:
-        for frequency in nu:
-            if frequency not in beam_frqs:
-                raise NotImplementedError("No routine for interpolating between beam frequencies.")
-    elif nu not in beam_frqs:
-        raise NotImplementedError("No routine for interpolating between beam frequencies.")
+    if not interpolate:
+        beam_frqs = get_beam_frqs()
+        if type(nu) == np.ndarray:
+            for frequency in nu:
+                if frequency not in beam_frqs:
+                    raise NotImplementedError("No routine for interpolating between beam frequencies.")
+        elif nu not in beam_frqs:
+            raise NotImplementedError("No routine for interpolating between beam frequencies.")
     
     if ra is not None:
         if dec is None:
@@ -121,7 +403,7 @@ def create_J(ra=None, dec=None, az=None, alt=None,
             alt = alt * np.ones(len(alt))
         #raise TypeError('shapes of inputs must be the same (got one list and one scalar).')    
         
-    return format_J(spline_beam_func(nu, alt, az))
+    return format_J(interpolate_beam(nu, alt, az), copy=False)
 
 def create_J_sky(nside, nu=151e6):
     """
@@ -130,21 +412,25 @@ def create_J_sky(nside, nu=151e6):
         greater nside yields a more finely-grained deck
     @nu : Hz
         frequency of beam for which we are generating a whole-sky deck
-    Use create_A_space if a Mueller sky is desired as the output.
+        (interpolated if it falls between beam channels)
+    Use create_A_sky if a Mueller sky is desired as the output.
     """
     theta, phi = hp.pix2ang(nside, np.arange(12 * nside ** 2))
     az = phi
     alt = np.pi / 2 - theta
-    J_raw = spline_beam_func(nu, alt, az)
-    return format_J(J_raw)
+    J_raw = interpolate_beam(nu, alt, az)
+    return format_J(J_raw, copy=False)
 
-create_A_sky = lambda nside, nu=151e6: \
-    np.array([create_A(J=Ji) for Ji in create_J_space(nside, nu)])
+create_A_sky = lambda nside, nu=151e6: create_A(J=create_J_sky(nside, nu))
 
 def create_A(ra=None, dec=None, az=None, alt=None, J=None,
              lat=None, lst=None, nu=151e6, radians=False):
     """
     Return the Mueller matrix A.
+    Given a single 2 x 2 Jones matrix @J, the result is 4 x 4;
+    given a stack of Jones matrices with shape (..., 2, 2)
+    (for example, the output of create_J), the result is the
+    matching (..., 4, 4) stack of Mueller matrices.
     @ra: right ascension of the source, in radians.
     @dec: declination of the source, in radians.
     @lat: latitude of point of observation, in radians
@@ -169,8 +455,87 @@ def create_A(ra=None, dec=None, az=None, alt=None, J=None,
     else:
         J = create_J(ra, dec, az, alt, lat, lst, nu, radians)
 
-    # It would be cool to switch functionality if we were given an array of J's
-    # in which case, we should individually calculate the A matrix for each one, and return that.
-    
-    J_outer = np.kron(J, np.conj(J))
-    return np.dot(Si, np.dot(J_outer, S))
+    J = np.asarray(J)
+
+    # Batched Kronecker product: J_outer[..., 2i + k, 2j + l]
+    # = J[..., i, j] * conj(J)[..., k, l], for every matrix in the stack
+    J_outer = np.einsum('...ij,...kl->...ikjl', J, np.conj(J))
+    J_outer = J_outer.reshape(J.shape[:-2] + (4, 4))
+    return np.matmul(Si, np.matmul(J_outer, S))
+
+class MuellerTable:
+    """
+    Precomputed Mueller beam on a HEALPix grid, one deck per frequency,
+    queried by bilinear HEALPix interpolation instead of
+    evaluating the spline beam.
+    @frqs : array of the N_nu frequencies [Hz] of the decks
+    @nside : HEALPix resolution of the decks
+    @A : N_nu x 12 nside^2 x 4 x 4 array of Mueller matrices,
+        in the pixel ordering of create_J_sky
+
+    Build one with build_mueller_table, or read one back with
+    load_mueller_table.
+    """
+    def __init__(self, frqs, nside, A):
+        self.frqs = np.atleast_1d(np.asarray(frqs, dtype=float))
+        self.nside = int(nside)
+        self.A = np.asarray(A)
+
+    def channel(self, nu=None):
+        """
+        Return the index of the deck for frequency @nu [Hz].
+        @nu may be omitted if the table holds only one frequency.
+        """
+        if nu is None:
+            if len(self.frqs) != 1:
+                raise TypeError("nu must be given for a table with " + \
+                                str(len(self.frqs)) + " frequencies.")
+            return 0
+        index = np.flatnonzero(self.frqs == nu)
+        if len(index) == 0:
+            raise ValueError(str(nu) + " Hz is not tabulated.")
+        return index[0]
+
+    def __call__(self, az, alt, nu=None):
+        """
+        Return the interpolated Mueller matrices at the
+        topocentric positions (@az, @alt) [radians] and frequency @nu.
+        Scalar positions give a 4 x 4 matrix;
+        arrays of positions give a matching (..., 4, 4) stack.
+        """
+        deck = self.A[self.channel(nu)]
+        theta = np.pi / 2 - np.asarray(alt)
+        pixels, weights = hp.get_interp_weights(
+            self.nside, theta, np.asarray(az))
+        # sum over the four neighboring pixels
+        return np.einsum('k...,k...ij->...ij', weights, deck[pixels])
+
+    def interpolator(self, nu=None):
+        """
+        Return a function of (az, alt) bound to the frequency @nu,
+        in the form expected by vis.new_sources_over_time.
+        """
+        return lambda az, alt: self(az, alt, nu)
+
+    def save(self, filepath):
+        """
+        Write the table to the .npz file at @filepath.
+        """
+        np.savez(filepath, frqs=self.frqs,
+                 nside=np.array(self.nside), A=self.A)
+
+def build_mueller_table(nside, frqs=151e6):
+    """
+    Return a MuellerTable over every pixel of a HEALPix grid of
+    resolution @nside, with one deck per frequency in @frqs [Hz].
+    """
+    frqs = np.atleast_1d(frqs)
+    return MuellerTable(
+        frqs, nside, np.array([create_A_sky(nside, nu) for nu in frqs]))
+
+def load_mueller_table(filepath):
+    """
+    Read back a MuellerTable written by MuellerTable.save.
+    """
+    saves = np.load(filepath, allow_pickle=False)
+    return MuellerTable(saves['frqs'], saves['nside'], saves['A'])
@@ -0,0 +1,355 @@
+"""
+Chunked, compressed, self-describing storage for simulated visibilities.
+
+A store is an HDF5 file (path ending in .h5 or .hdf5, via h5py)
+or a Zarr group (path ending in .zarr, via zarr) with the layout
+    frequencies : N_nu frequencies [Hz]
+    times : N_t LSTs [radians]
+    baselines : N_bl x 2 antenna ID # pairs (ant1, ant2)
+    visibilities : N_bl x N_nu x N_t x 4 complex (I, Q, U, V),
+        chunked one baseline and a block of LSTs at a time
+    sources : catalog indices of the sources summed so far
+    attrs : title, plus any other metadata of the simulation
+
+Single-baseline results (helices, cold_tensor) are stores with N_bl = 1.
+Readers pull in only the chunks they touch, so one baseline or one
+LST slice can be read without loading the rest, and writers can add
+per-source or per-chunk results as they are produced.
+
+Neither h5py nor zarr is required by the rest of skyflux,
+so each is imported only when a store of its kind is opened.
+"""
+
+import warnings as w
+
+import numpy as np
+
+from skyflux import catalog
+from skyflux import wedge
+
+hdf5_extensions = (".h5", ".hdf5")
+zarr_extensions = (".zarr",)
+
+# the extension written for each format name
+extensions = {"hdf5" : ".h5", "zarr" : ".zarr"}
+
+# target size [bytes] of one chunk of visibilities
+CHUNK_BYTES = 2 ** 20
+
+# number of baselines read, summed and written at a time
+# by the block-wise operations below
+ROW_BLOCK = 64
+
+def is_store(path):
+    """
+    Return True if @path names a store (by its extension).
+    """
+    return path.endswith(hdf5_extensions + zarr_extensions)
+
+def _open_group(path, mode):
+    if path.endswith(hdf5_extensions):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError("Reading or writing " + path + \
+                " requires h5py (pip install h5py).")
+        return h5py.File(path, mode)
+    if path.endswith(zarr_extensions):
+        try:
+            import zarr
+        except ImportError:
+            raise ImportError("Reading or writing " + path + \
+                " requires zarr (pip install zarr).")
+        return zarr.open_group(path, mode=mode)
+    raise ValueError(path + " is neither an HDF5 (" + \
+        ", ".join(hdf5_extensions) + ") nor a Zarr (" + \
+        ", ".join(zarr_extensions) + ") path.")
+
+def _is_hdf5(group):
+    return type(group).__module__.startswith("h5py")
+
+def _create_array(group, name, data=None, shape=None, dtype=None,
+                  chunks=None, growable=None):
+    """
+    Create the array @name in @group, either from @data or empty
+    with @shape and @dtype. @growable is the index of the axis,
+    if any, along which the array may later be resized.
+    """
+    if data is not None:
+        data = np.asarray(data)
+        shape = data.shape
+        dtype = data.dtype
+    if chunks is None:
+        chunks = tuple(max(1, n) for n in shape)
+
+    if _is_hdf5(group):
+        maxshape = None
+        if growable is not None:
+            maxshape = tuple(None if axis == growable else n
+                             for axis, n in enumerate(shape))
+        return group.create_dataset(
+            name, shape=shape, dtype=dtype, data=data, chunks=chunks,
+            maxshape=maxshape, compression="gzip", shuffle=True)
+
+    # zarr arrays are always resizable and compressed by default;
+    # zarr 3 renamed create_dataset to create_array
+    if hasattr(group, "create_array"):
+        create = group.create_array
+    else:
+        create = group.create_dataset
+    array = create(name, shape=shape, dtype=dtype, chunks=chunks,
+                   overwrite=True)
+    if data is not None:
+        array[...] = data
+    return array
+
+class VisibilityStore:
+    """
+    An open store of visibilities (see the module docstring).
+    Use create or open_store rather than calling this directly.
+    """
+    def __init__(self, group, path):
+        self.group = group
+        self.path = path
+
+        self.frequencies = self.group["frequencies"][...]
+        self.baselines = self.group["baselines"][...].reshape(-1, 2)
+        self.index = {(ID1, ID2): b
+                      for b, (ID1, ID2) in enumerate(self.baselines.tolist())}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        # zarr groups need no closing
+        if _is_hdf5(self.group):
+            self.group.close()
+
+    @property
+    def visibilities(self):
+        """
+        The lazily-read N_bl x N_nu x N_t x 4 array;
+        slicing it reads only the chunks concerned.
+        """
+        return self.group["visibilities"]
+
+    @property
+    def times(self):
+        # not cached, because append_times can extend it
+        return self.group["times"][...]
+
+    @property
+    def title(self):
+        return str(self.group.attrs.get("title", ""))
+
+    @title.setter
+    def title(self, title):
+        self.group.attrs["title"] = title
+
+    @property
+    def metadata(self):
+        return dict(self.group.attrs)
+
+    @property
+    def sources(self):
+        return self.group["sources"][...]
+
+    def baseline(self, ant1, ant2):
+        """
+        Read the N_nu x N_t x 4 visibilities of @ant1 -> @ant2 only.
+        """
+        return self.visibilities[self.index[(ant1, ant2)]]
+
+    def lst_slice(self, t_indices):
+        """
+        Read the N_bl x N_nu x |@t_indices| x 4 visibilities
+        at the LSTs @t_indices (an index, slice or sorted index array).
+        """
+        if np.ndim(t_indices) == 0 and not isinstance(t_indices, slice):
+            t_indices = slice(t_indices, t_indices + 1)
+        return self.visibilities[:, :, t_indices]
+
+    def select(self, pairs):
+        """
+        Return the wedge.Wedge of only the baselines @pairs
+        (rows of (ant1, ant2)), reading only those baselines.
+        """
+        pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        data = np.array([self.baseline(ID1, ID2)
+                         for ID1, ID2 in pairs.tolist()])
+        return wedge.Wedge(pairs, self.frequencies, self.times, data)
+
+    def to_wedge(self):
+        """
+        Read the whole store into a wedge.Wedge.
+        """
+        return wedge.Wedge(self.baselines, self.frequencies, self.times,
+                           self.visibilities[...])
+
+    def write(self, data, rows=slice(None), t_indices=slice(None)):
+        """
+        Overwrite the visibilities of the baselines @rows
+        at the LSTs @t_indices with @data.
+        """
+        # h5py does not convert real data to the complex type itself
+        self.visibilities[rows, :, t_indices] = \
+            np.asarray(data, dtype=np.complex128)
+
+    def accumulate(self, data, rows=slice(None), sources=None,
+                   coherent=False):
+        """
+        Add @data (|@rows| x N_nu x N_t x 4) into the visibilities of
+        the baselines @rows (see wedge.accumulate for @coherent),
+        recording the catalog indices @sources as summed.
+        Large stores are best accumulated a block of rows at a time.
+        """
+        block = self.visibilities[rows]
+        wedge.accumulate(block, data, coherent)
+        self.visibilities[rows] = block
+        if sources is not None:
+            self.add_sources(sources)
+
+    def write_wedge(self, block):
+        """
+        Overwrite every baseline with those of the wedge.Wedge @block,
+        expanding its redundant groups ROW_BLOCK baselines at a time.
+        """
+        for start in range(0, len(block.all_pairs), ROW_BLOCK):
+            rows = slice(start, start + ROW_BLOCK)
+            self.write(block.expanded_rows(rows), rows=rows)
+
+    def accumulate_wedge(self, block, sources=None, coherent=False):
+        """
+        Add the wedge.Wedge @block into every baseline (see accumulate),
+        expanding its redundant groups ROW_BLOCK baselines at a time.
+        """
+        for start in range(0, len(block.all_pairs), ROW_BLOCK):
+            rows = slice(start, start + ROW_BLOCK)
+            self.accumulate(block.expanded_rows(rows), rows,
+                            coherent=coherent)
+        if sources is not None:
+            self.add_sources(sources)
+
+    def add_sources(self, sources):
+        """
+        Record the catalog indices @sources as summed into the store.
+        """
+        sources = np.atleast_1d(np.asarray(sources, dtype=np.int64))
+        array = self.group["sources"]
+        n = array.shape[0]
+        array.resize((n + len(sources),))
+        array[n:] = sources
+
+    def append_times(self, times, data):
+        """
+        Extend the LST axis by @times, with visibilities
+        @data (N_bl x N_nu x |@times| x 4).
+        """
+        times = np.atleast_1d(times)
+        vis = self.visibilities
+        n = vis.shape[2]
+        vis.resize(vis.shape[:2] + (n + len(times), 4))
+        vis[:, :, n:] = np.asarray(data, dtype=np.complex128)
+
+        t_array = self.group["times"]
+        t_array.resize((n + len(times),))
+        t_array[n:] = times
+
+def create(path, baselines, frequencies, times, title="", **metadata):
+    """
+    Create (overwriting) a store at @path with zeroed visibilities
+    for the N_bl x 2 antenna pairs @baselines over the
+    @frequencies [Hz] and @times [radians], and return it open
+    for writing. @title and @metadata are kept as attributes.
+    """
+    group = _open_group(path, "w")
+
+    baselines = np.asarray(baselines, dtype=int).reshape(-1, 2)
+    frequencies = np.asarray(frequencies, dtype=float)
+    times = np.asarray(times, dtype=float)
+
+    _create_array(group, "frequencies", frequencies)
+    _create_array(group, "baselines", baselines)
+    _create_array(group, "times", times, chunks=(max(1, len(times)),),
+                  growable=0)
+    _create_array(group, "sources", shape=(0,), dtype=np.int64,
+                  chunks=(1024,), growable=0)
+
+    # one baseline, every frequency, and as many LSTs as fit
+    chunk_t = max(1, min(len(times),
+                         CHUNK_BYTES // (16 * 4 * max(1, len(frequencies)))))
+    _create_array(group, "visibilities",
+                  shape=(len(baselines), len(frequencies), len(times), 4),
+                  dtype=np.complex128,
+                  chunks=(1, len(frequencies), chunk_t, 4), growable=2)
+
+    group.attrs["title"] = title
+    for key, value in metadata.items():
+        group.attrs[key] = value
+    return VisibilityStore(group, path)
+
+def open_store(path, mode="r"):
+    """
+    Open the existing store at @path;
+    @mode "r" for reading, "r+" to also write.
+    """
+    return VisibilityStore(_open_group(path, mode), path)
+
+def save_wedge(block, path, title="", sources=None, **metadata):
+    """
+    Write the wedge.Wedge @block, the sum over the catalog indices
+    @sources, to a new store at @path, a block of baselines at a time.
+    Redundant groups are expanded to every baseline as they are written.
+    """
+    with create(path, block.all_pairs, block.frequencies, block.times,
+                title, **metadata) as out:
+        out.write_wedge(block)
+        if sources is not None:
+            out.add_sources(sources)
+
+def save_tensor(v_tensor, path, frequencies, times, ant1, ant2,
+                title="", sources=None, **metadata):
+    """
+    Write the N_nu x N_t x 4 visibilities @v_tensor of the single
+    baseline @ant1 -> @ant2, the sum over the catalog indices
+    @sources, to a new store at @path.
+    """
+    with create(path, [(ant1, ant2)], frequencies, times,
+                title, **metadata) as out:
+        out.write(v_tensor[np.newaxis])
+        if sources is not None:
+            out.add_sources(sources)
+
+def catalog_indices(names):
+    """
+    Return the catalog indices of the sources called @names,
+    for the sources record of a store. Sources that are not in the
+    catalog (hand-built ones, say) have no index; they are left out,
+    with a warning.
+    """
+    idx = np.array([catalog.lookup(name) for name in names],
+                   dtype=np.int64)
+    if np.any(idx < 0):
+        w.warn(str(np.count_nonzero(idx < 0)) + " of the" + \
+            " sources are not in the catalog, so the store" + \
+            " cannot record them.")
+    return idx[idx >= 0]
+
+def compatible(first, second):
+    """
+    Return True if the stores @first and @second have the same
+    baselines, frequencies and times.
+    """
+    return np.array_equal(first.baselines, second.baselines) and \
+        np.array_equal(first.frequencies, second.frequencies) and \
+        np.array_equal(first.times, second.times)
+
+def load_wedge(path):
+    """
+    Return the wedge.Wedge and title of the store at @path.
+    """
+    with open_store(path) as source:
+        return source.to_wedge(), source.title
@@ -25,5 +25,13 @@ try:
         obj_catalog.append(catalog.GLEAM_entry(line[1:]))
     f.close()
     np.save(data_prefix + '../catalog.npy', obj_catalog, allow_pickle=True)
+
+    # the columnar table does not need the objects at all
+    table, missing_flux, missing_alpha = \
+        catalog.parse_gleam(data_prefix + "gleam_with_alpha.txt")
+    print("Sources missing at least one flux:",
+          np.sum(missing_flux.any(axis=1)))
+    print("Sources missing a spectral index:", np.sum(missing_alpha))
+    catalog.save_table(table, data_prefix + '../catalog_table.npy')
 except FileNotFoundError:
     print("Failure to load gleam catalog.")
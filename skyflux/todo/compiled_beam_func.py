@@ -19,6 +19,8 @@ import numpy as np
 import os
 from RIMEz import beam_models
 
+from skyflux import stokes
+
 here = os.path.dirname(os.path.abspath(__file__)) + "/"
 
 # It is imperative that the names here line up with those used in
@@ -43,3 +45,11 @@ print("\nParams computed. Storing full results...")
 sbf_storage = np.array([nu_axis, tx, ty, kx, ky, E_coeffs, rE_coeffs])
 
 np.save(here + output_name, sbf_storage, allow_pickle=True)
+
+print("\nStoring memory-mappable copy of the parameters...")
+
+# skyflux.stokes prefers this plain-array layout, which it can
+# memory-map lazily instead of unpickling at import time;
+# stokes.convert_sbf_params names the files after stokes.sbf_param_names.
+stokes.convert_sbf_params(origin=here + output_name + ".npy",
+                          destination=here + output_name + "/")
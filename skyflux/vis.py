@@ -2,6 +2,7 @@
 Utilities for evaluating the visibility sky integral.
 """
 
+import collections
 import warnings as w
 
 import numpy as np
@@ -16,6 +17,256 @@ def get_I(source, nu=151e6):
     S151 = source.flux_by_frq[151]
     return S151 * (nu / 151e6) ** source.alpha
 
+# Spectral models. Each one takes
+#     @rows : records of catalog.table (N_src of them)
+#     @nu_axis : array of N_nu frequencies [Hz]
+# and returns the N_src x N_nu matrix of Stokes I [Jy].
+
+def power_law(rows, nu_axis):
+    """
+    The model of get_I: the 151 MHz flux, scaled by the spectral index.
+    """
+    S151 = rows['flux'][:, catalog.frq_index(151)]
+    return S151[:, np.newaxis] * \
+        (nu_axis[np.newaxis, :] / 151e6) ** rows['alpha'][:, np.newaxis]
+
+def curved_power_law(rows, nu_axis):
+    """
+    A power law with curvature,
+        ln S = ln S151 + a x + q x^2, where x = ln(nu / 151 MHz),
+    least-squares fitted to the twenty GLEAM bands of each source.
+    Sources missing any band flux fall back to power_law.
+    """
+    x_bands = np.log(np.array(catalog.expected_frequencies) / 151)
+    design = np.stack((np.ones_like(x_bands), x_bands, x_bands ** 2),
+                      axis=-1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_flux = np.log(rows['flux'])
+    complete = np.all(np.isfinite(log_flux), axis=1)
+
+    # one shared design matrix, so all sources are fitted in one solve
+    coeffs = np.linalg.lstsq(
+        design, log_flux[complete].T, rcond=None)[0] # 3 x N_complete
+
+    x = np.log(nu_axis / 151e6)
+    spectra = power_law(rows, nu_axis)
+    spectra[complete] = np.exp(coeffs[0][:, np.newaxis] +
+                               coeffs[1][:, np.newaxis] * x +
+                               coeffs[2][:, np.newaxis] * x ** 2)
+    return spectra
+
+def band_interpolation(rows, nu_axis):
+    """
+    Linear interpolation, in log flux against log frequency,
+    between the two GLEAM bands that bracket each frequency
+    (extrapolated along the outermost pair beyond the band edges).
+    Missing band fluxes propagate as NaN.
+    """
+    log_bands = np.log(np.array(catalog.expected_frequencies) * 1e6)
+    x = np.log(nu_axis)
+    hi = np.clip(np.searchsorted(log_bands, x), 1, len(log_bands) - 1)
+    lo = hi - 1
+    weight = (x - log_bands[lo]) / (log_bands[hi] - log_bands[lo])
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        log_flux = np.log(rows['flux'])
+    return np.exp((1 - weight) * log_flux[:, lo] +
+                  weight * log_flux[:, hi])
+
+spectral_models = {
+    'power_law' : power_law,
+    'curved_power_law' : curved_power_law,
+    'band_interpolation' : band_interpolation
+}
+
+# number of (nu_axis, model) spectral tensors kept at once;
+# each holds a float per catalog source and frequency
+SPECTRAL_CACHE_SIZE = 4
+
+_spectral_tensors = collections.OrderedDict()
+
+def spectral_tensor(nu_axis, model='power_law'):
+    """
+    Return the N_src x N_nu matrix of Stokes I [Jy] for every source
+    in catalog.table at every frequency of @nu_axis [Hz],
+    according to the spectral @model
+        (a key of spectral_models, or a function of the same form).
+    The matrix is computed once per (nu_axis, model) and then reused;
+    the SPECTRAL_CACHE_SIZE most recently used matrices are kept.
+    """
+    nu_axis = np.atleast_1d(np.asarray(nu_axis, dtype=float))
+    key = (nu_axis.tobytes(), model)
+    if key in _spectral_tensors:
+        _spectral_tensors.move_to_end(key)
+    else:
+        _spectral_tensors[key] = _spectral_model(model)(
+            catalog.table, nu_axis)
+        while len(_spectral_tensors) > max(SPECTRAL_CACHE_SIZE, 1):
+            _spectral_tensors.popitem(last=False)
+    return _spectral_tensors[key]
+
+def _spectral_model(model):
+    if callable(model):
+        return model
+    return spectral_models[model]
+
+def source_spectrum(source, nu_axis, model='power_law'):
+    """
+    Return the Stokes I [Jy] of the GLEAM object @source at every
+    frequency of @nu_axis [Hz]. As in source_table, the spectrum
+    is computed from the object's own attributes, so a hand-built
+    or modified source is used as given.
+    """
+    nu_axis = np.atleast_1d(np.asarray(nu_axis, dtype=float))
+    return _spectral_model(model)(
+        catalog.entries_to_table([source]), nu_axis)[0]
+
+def stokes_axis(source, nu_axis, model='power_law'):
+    """
+    Return the N_nu x 4 array of unpolarized Stokes vectors
+        [I, 0, 0, 0]
+    of the GLEAM object @source over @nu_axis [Hz].
+    """
+    s_axis = np.zeros((len(nu_axis), 4), dtype=np.complex128)
+    s_axis[:, 0] = source_spectrum(source, nu_axis, model)
+    return s_axis
+
+def source_indices(sources):
+    """
+    Return the indices (in catalog.srcs and catalog.table) of @sources,
+    which may be an array of indices, a single GLEAM catalog object,
+    or a list/array of GLEAM catalog objects.
+    """
+    if isinstance(sources, catalog.GLEAM_entry):
+        sources = [sources]
+    sources = np.atleast_1d(np.asarray(sources, dtype=object))
+    if len(sources) == 0 or not isinstance(sources[0], catalog.GLEAM_entry):
+        return sources.astype(int)
+
+    idx = np.array([catalog.lookup(source.name) for source in sources])
+    if np.any(idx < 0):
+        raise ValueError("Some of the given sources are not in the catalog.")
+    return idx
+
+def source_table(sources, nu_axis, model='power_law'):
+    """
+    Return (ra, dec, spectra) for @sources (see source_indices):
+        ra, dec : N_src positions [radians]
+        spectra : N_src x N_nu Stokes I [Jy] over @nu_axis [Hz]
+            according to the spectral @model
+    Catalog indices are read from catalog.table and the cached
+    spectral_tensor. GLEAM objects are read from their own
+    attributes, so hand-built or modified sources, which the
+    catalog does not know or knows differently, are used as given.
+    """
+    if isinstance(sources, catalog.GLEAM_entry):
+        sources = [sources]
+    sources = np.atleast_1d(np.asarray(sources, dtype=object))
+    if len(sources) and isinstance(sources[0], catalog.GLEAM_entry):
+        rows = catalog.entries_to_table(sources)
+        return rows['ra'], rows['dec'], \
+            _spectral_model(model)(rows, nu_axis)
+
+    idx = sources.astype(int)
+    return catalog.table['ra'][idx], catalog.table['dec'][idx], \
+        spectral_tensor(nu_axis, model)[idx]
+
+# Upper bound [bytes] on the working memory of one chunk of sources
+# in visibilities. The output tensor is not counted.
+MEMORY_BUDGET = 2 ** 28
+
+def chunk_size(n_t, n_nu, memory_budget=None):
+    """
+    Return the number of sources that visibilities may process at once
+    for @n_t LSTs and @n_nu frequencies without exceeding
+    @memory_budget [bytes] (default: MEMORY_BUDGET).
+    At least one source is always processed.
+    """
+    if memory_budget is None:
+        memory_budget = MEMORY_BUDGET
+    # Peak bytes per (source, LST), measured with tracemalloc over
+    # single chunks for 1 to 256 channels. The peak falls in one of
+    # two stages, each with 16 floats of positions (az, alt, l, m,
+    # their flattened copies and the mask):
+    #     phase_factors : the phases and the exponential
+    #         being formed from them, 2 N_nu complex
+    #     each channel : the weights, N_nu complex, plus 64 complex
+    #         for the two beam channels of interpolate_beam, the
+    #         interpolated and formatted J, and the kron/matmul
+    #         buffers of create_A
+    # Scratch memory inside the spline evaluator itself is not counted.
+    per_source = n_t * (16 * 8 + max(2 * n_nu, n_nu + 64) * 16)
+    return max(1, int(memory_budget // per_source))
+
+def visibilities(ant1, ant2, sources, lsts, frqs,
+                 model='power_law', min_alt=None,
+                 out=None, memory_budget=None, progress=None):
+    """
+    Batched visibility kernel: the visibilities of the baseline
+    @ant1 -> @ant2, summed over @sources, for every combination of
+        @lsts : local sidereal times [float or array, radians]
+        @frqs : frequencies [float or array, Hz]
+    @sources : see source_table
+    @model : spectral model (see spectral_tensor)
+    @min_alt : if given, a source contributes only while its altitude
+        is at least @min_alt [radians]
+    @out : if given, a |frqs| x |lsts| x 4 complex array
+        to which the visibilities are added in place
+    @memory_budget : bytes of scratch memory per chunk of sources
+        (see chunk_size)
+    @progress : if given, called as progress(done, total)
+        after each chunk of sources
+
+    The sources are streamed in chunks of chunk_size(...) at a time,
+    so memory use does not grow with the number of sources.
+
+    Returns the |frqs| x |lsts| x 4 complex array of summed
+    (I, Q, U, V) visibilities.
+    """
+    lsts = np.atleast_1d(np.asarray(lsts, dtype=float))
+    frqs = np.atleast_1d(np.asarray(frqs, dtype=float))
+    ras, decs, spectra = source_table(sources, frqs, model)
+
+    shape = (len(frqs), len(lsts), 4)
+    if out is None:
+        out = np.zeros(shape, dtype=np.complex128)
+    elif out.shape != shape:
+        raise ValueError("out has shape " + str(out.shape) + \
+            ", expected " + str(shape))
+
+    geometry = rot.observation_geometry(lsts)
+    pair = [(ant1, ant2)]
+
+    step = chunk_size(len(lsts), len(frqs), memory_budget)
+    for first in range(0, len(ras), step):
+        chunk = slice(first, first + step)
+        ra = ras[chunk]
+        dec = decs[chunk]
+
+        az, alt = geometry.topo(ra, dec) # N_chunk x N_t
+        l, m = geometry.lm(ra, dec)
+
+        # N_chunk x N_t x N_nu
+        weights = ant.array.phase_factors(
+            np.stack((l, m), axis=-1), frqs, pairs=pair)[0]
+        weights *= spectra[chunk][:, np.newaxis, :]
+        if min_alt is not None:
+            weights[alt < min_alt] = 0
+
+        for fi in range(len(frqs)):
+            J = stokes.create_J(az=az.ravel(), alt=alt.ravel(),
+                                nu=frqs[fi], radians=True)
+            A = stokes.create_A(J=J).reshape(az.shape + (4, 4))
+            # The sources are unpolarized, s = (I, 0, 0, 0),
+            # so only the first column of each A survives A . s
+            out[fi] += np.einsum('sti,st->ti',
+                                 A[..., :, 0], weights[..., fi])
+
+        if progress is not None:
+            progress(first + len(ra), len(ras))
+    return out
+
 def visibility(ant1, ant2, source, nu=151e6, time=None):
     """
     Visibility integrand evaluated for a single source.
@@ -27,21 +278,21 @@ def visibility(ant1, ant2, source, nu=151e6, time=None):
     @time : local sidereal time [float, radians]
         default: None corresponds to run-time LST.
     """
-    I = get_I(source, nu)
-        
-    s = np.array([complex(I), 0, 0, 0])
-
-    ra = np.radians(source.ra_angle)
-    dec = np.radians(source.dec_angle)
-    
-    A = stokes.create_A(ra=ra, dec=dec, lst=time, nu=nu, radians=True)
-    r = rot.radec2lm(ra, dec, ra0=time)
-    
-    phi = ant.phase_factor(ant1, ant2, r, nu)
+    if time is None:
+        time = rot.get_lst(radians=True)
+    return visibilities(ant1, ant2, source, time, nu)[0, 0]
 
-    malformed_result = np.dot(np.dot(A, s), phi)
-    # Hack to get rid of extra array shell surrounding answer
-    return malformed_result[:, 0]
+def _tag_axis(axis, V):
+    """
+    Pair each value of @axis with the corresponding 4-vector in @V,
+    in the [value, visibility] row format returned by
+    sources_over_time and sources_over_frequency.
+    """
+    rows = np.empty((len(axis), 2), dtype=object)
+    rows[:, 0] = axis
+    for k in range(len(axis)):
+        rows[k, 1] = V[k]
+    return rows
 
 # Incoming function, intended to replace sources_over_time
 def new_sources_over_time(ant1, ant2,
@@ -63,6 +314,9 @@ def new_sources_over_time(ant1, ant2,
     @interval: integration window width [float, radians]
         default: 10 minutes = np.pi / 72
     @nu frequency in Hertz
+    @interpolator function of (az, alt) [radians] returning the
+        Mueller matrix; for example
+        stokes.load_mueller_table(filepath).interpolator(nu)
     """
     if interpolator is None:
         raise NotImplementedError("We are" + \
@@ -117,7 +371,8 @@ def new_sources_over_time(ant1, ant2,
     return list_lst, np.array(list_visibilities)
 
 def sources_over_time(ant1, ant2, list_sources=None,
-                        start=0, end=2/3*np.pi, interval=np.pi/72, nu=151e6):
+                        start=0, end=2/3*np.pi, interval=np.pi/72, nu=151e6,
+                        memory_budget=None, min_alt=None):
     """
     Return an array containing the visibilities at different points of time.
     @ant1 and @ant2 are indices of antennae, to specify a baseline.
@@ -130,28 +385,32 @@ def sources_over_time(ant1, ant2, list_sources=None,
     @interval: integration window width [float, radians]
         default: 10 minutes = np.pi / 72
     @nu frequency in Hertz
+    @memory_budget: bytes of scratch memory per chunk of sources
+        default: None translates to MEMORY_BUDGET
+    @min_alt: a source contributes only while its altitude is at least
+        @min_alt [radians], whichever sources are given
+        default: None translates to the horizon (0) for the default
+        source list and to no cut for an explicit @list_sources
     """
-    if list_sources is None:
-        # make a copy to ensure write safety
-        list_sources = catalog.obj_catalog.copy()
-
-    # If the user has entered a single source directly,
-    # we can automatically standardize the formatting
-    # by placing it by itself in a list
-    if type(list_sources) != list:
-        list_sources = [list_sources]
-    
-    list_visibilities = []
+    list_lst = []
     lst = start
     while lst <= end:
-        next_vista = np.array([0j, 0j, 0j, 0j])
-        for source in list_sources:
-            next_vista += visibility(ant1, ant2, source, nu=nu, time=lst)
-
-        list_visibilities.append(np.array([lst, next_vista]))
+        list_lst.append(lst)
         lst += interval
-    # perhaps not necessary. Better safe than sorry:
-    return np.array(list_visibilities)
+    list_lst = np.array(list_lst)
+
+    if list_sources is None:
+        if min_alt is None:
+            min_alt = 0
+        # Sources that never clear min_alt cannot contribute;
+        # skip them without computing their altitudes.
+        list_sources = np.intersect1d(
+            catalog.sky_index().visible_during(list_lst, min_alt=min_alt),
+            catalog.query(valid_alpha=True))
+
+    V = visibilities(ant1, ant2, list_sources, list_lst, nu,
+                     min_alt=min_alt, memory_budget=memory_budget)
+    return _tag_axis(list_lst, V[0])
 
 def sources_over_frequency(ant1, ant2, list_sources=None,
                         start=76e6, end=227e6, interval=1e6, time=None):
@@ -171,25 +430,16 @@ def sources_over_frequency(ant1, ant2, list_sources=None,
         default: None translates to the LST as of the initial call of this function
     """
     if list_sources is None:
-        # make a copy to ensure write safety
-        list_sources = catalog.obj_catalog.copy()
+        list_sources = catalog.query(valid_alpha=True)
     if time is None:
         time = rot.get_lst(radians=True)
 
-    # If the user has entered a single source directly,
-    # we can automatically standardize the formatting
-    # by placing it by itself in a list
-    if type(list_sources) != list:
-        list_sources = [list_sources]
-    
-    list_visibilities = []
+    list_frq = []
     lfreq = start
     while lfreq <= end:
-        next_vista = np.array([0j, 0j, 0j, 0j])
-        for source in list_sources:
-            next_vista += visibility(ant1, ant2, source, nu=lfreq, time=time)
-
-        list_visibilities.append(np.array([lfreq, next_vista]))
+        list_frq.append(lfreq)
         lfreq += interval
-    # perhaps not necessary. Better safe than sorry:
-    return np.array(list_visibilities)
+    list_frq = np.array(list_frq)
+
+    V = visibilities(ant1, ant2, list_sources, time, list_frq)
+    return _tag_axis(list_frq, V[:, 0])
@@ -0,0 +1,282 @@
+"""
+Array-backed container for wedge simulations: the visibilities of
+every baseline over a grid of frequencies and LSTs.
+"""
+
+import os
+
+import numpy as np
+
+from skyflux import ant
+
+class Wedge:
+    """
+    Visibilities of a set of baselines.
+
+    @pairs : N_bl x 2 array of antenna ID # pairs (ant1, ant2);
+        the baseline index table. Row b of @pairs describes data[b].
+    @frequencies : N_nu frequencies [Hz]
+    @times : N_t LSTs [radians]
+    @data : N_bl x N_nu x N_t x 4 complex array of
+        (I, Q, U, V) visibilities. Default: zeros.
+    @redundancy : optional (all_pairs, group, conjugated),
+        for a wedge that holds one row per redundant group
+        (see ant.AntennaArray.redundancy). @pairs are then the
+        representatives of the groups, all_pairs the baselines
+        they stand for, and expand gives every baseline.
+    """
+    def __init__(self, pairs, frequencies, times, data=None,
+                 redundancy=None):
+        self.pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        self.frequencies = np.asarray(frequencies)
+        self.times = np.asarray(times)
+
+        shape = (len(self.pairs), len(self.frequencies),
+                 len(self.times), 4)
+        if data is None:
+            data = np.zeros(shape, dtype=np.complex128)
+        elif data.shape != shape:
+            raise ValueError("data has shape " + str(data.shape) + \
+                ", expected " + str(shape))
+        self.data = data
+
+        self.index = {(ID1, ID2): b
+                      for b, (ID1, ID2) in enumerate(self.pairs.tolist())}
+
+        self.redundancy = None
+        self.all_pairs = self.pairs
+        self.all_index = self.index
+        if redundancy is not None:
+            all_pairs, group, conjugated = redundancy
+            self.all_pairs = np.asarray(all_pairs, dtype=int).reshape(-1, 2)
+            self.redundancy = (self.all_pairs, np.asarray(group),
+                               np.asarray(conjugated, dtype=bool))
+            self.all_index = {(ID1, ID2): b for b, (ID1, ID2)
+                              in enumerate(self.all_pairs.tolist())}
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def baseline(self, ant1, ant2):
+        """
+        Return the N_nu x N_t x 4 visibilities of the baseline
+        @ant1 -> @ant2. For a baseline with a row of its own
+        this is a view: writes go to the wedge. Any other
+        baseline of all_pairs is expanded from its group.
+        """
+        if (ant1, ant2) in self.index:
+            return self.data[self.index[(ant1, ant2)]]
+        b = self.all_index[(ant1, ant2)]
+        return self.expanded_rows(slice(b, b + 1))[0]
+
+    def expanded_rows(self, rows):
+        """
+        Return the visibilities of the baselines all_pairs[@rows]
+        (an index array or slice), expanding redundant groups.
+        """
+        if self.redundancy is None:
+            return self.data[rows]
+        _, group, conjugated = self.redundancy
+        return ant.expand_redundant(
+            self.data, group[rows], conjugated[rows])
+
+    def expand(self):
+        """
+        Return the wedge with one row per baseline of all_pairs;
+        that is this wedge itself if it has no redundancy.
+        """
+        if self.redundancy is None:
+            return self
+        return Wedge(self.all_pairs, self.frequencies, self.times,
+                     self.expanded_rows(slice(None)))
+
+    def select(self, pairs):
+        """
+        Return a new wedge holding only the baselines
+        whose rows (ant1, ant2) are listed in @pairs.
+        """
+        pairs = np.asarray(pairs, dtype=int).reshape(-1, 2)
+        rows = np.array([self.all_index[(ID1, ID2)]
+                         for ID1, ID2 in pairs.tolist()], dtype=int)
+        return Wedge(pairs, self.frequencies, self.times,
+                     self.expanded_rows(rows))
+
+    def copy(self):
+        return Wedge(self.pairs, self.frequencies, self.times,
+                     self.data.copy(), self.redundancy)
+
+    def transform(self, window=None):
+        """
+        Return a new wedge containing the Fourier transform,
+        along frequency, of every baseline, LST and Stokes parameter,
+        after multiplication by @window (an N_nu taper; default: none).
+        Redundant groups are expanded first, since the transform
+        of a conjugated baseline is not the conjugate of the
+        transform; the result has one row per baseline of all_pairs.
+        """
+        full = self.expand()
+        data = full.data
+        if window is not None:
+            data = data * window[np.newaxis, :, np.newaxis, np.newaxis]
+        return Wedge(full.pairs, full.frequencies, full.times,
+                     np.fft.fft(data, axis=1))
+
+    def compatible(self, other):
+        """
+        Return True if @other has the same baselines,
+        frequencies and times as this wedge.
+        """
+        return np.array_equal(self.pairs, other.pairs) and \
+            np.array_equal(self.all_pairs, other.all_pairs) and \
+            np.array_equal(self.frequencies, other.frequencies) and \
+            np.array_equal(self.times, other.times)
+
+    def accumulate(self, other, coherent=False):
+        """
+        Add the wedge @other into this one, in place (see accumulate).
+        Returns this wedge.
+        """
+        if not self.compatible(other):
+            raise ValueError("Wedges with different baselines," + \
+                " frequencies or times cannot be merged.")
+        accumulate(self.data, other.data, coherent)
+        return self
+
+    def to_dict(self):
+        """
+        Return the legacy nested-dictionary form,
+            wedge[ant1][ant2] = N_nu x N_t x 4 array
+        """
+        full = self.expand()
+        nested = {}
+        for b, (ID1, ID2) in enumerate(full.pairs.tolist()):
+            nested.setdefault(ID1, {})[ID2] = full.data[b]
+        return nested
+
+def accumulate(target, source, coherent=False):
+    """
+    Add the visibilities @source into the array @target, in place.
+    @coherent
+        True: complex sum, target += source
+        False: magnitude sum, target = |target| + |source|,
+            so that phases do not produce spurious
+            interference patterns between sources
+    The sum costs one pass over the data and
+    at most one temporary the size of @source.
+    """
+    if coherent:
+        target += source
+    else:
+        np.abs(target, out=target)
+        target += np.abs(source)
+    return target
+
+def from_dict(nested, frequencies, times):
+    """
+    Return the Wedge equivalent of the legacy nested dictionary
+    @nested[ant1][ant2] = N_nu x N_t x 4 array.
+    """
+    pairs = [(ID1, ID2) for ID1 in nested for ID2 in nested[ID1]]
+    data = np.array([nested[ID1][ID2] for ID1, ID2 in pairs],
+                    dtype=np.complex128)
+    return Wedge(pairs, frequencies, times, data)
+
+def package(wedge, ptitle):
+    """
+    Return the print-ready dictionary under which a wedge is pickled
+    (see utils.pickle_dict). Redundant groups are expanded,
+    so the pickle holds every baseline.
+    """
+    wedge = wedge.expand()
+    return {'frequencies' : wedge.frequencies,
+            'times' : wedge.times,
+            'baselines' : wedge.pairs,
+            'picture' : wedge.data,
+            'title' : ptitle}
+
+def unpackage(meta):
+    """
+    Return the Wedge stored in the dictionary @meta (see package).
+    Simulations saved before the array format, whose 'picture'
+    is a nested antenna dictionary, are converted.
+    """
+    fs = meta['frequencies']
+    ts = meta['times']
+    if 'baselines' in meta:
+        return Wedge(meta['baselines'], fs, ts, meta['picture'])
+    return from_dict(meta['picture'], fs, ts)
+
+"""
+Besides pickles (see package), a wedge may be saved as a directory
+<label>.wedge/ of plain .npy files, one per array, like the beam
+parameters in stokes.sbfps_dir. The visibilities can then be
+memory-mapped, so a wedge on disk can be read or merged a block
+of baselines at a time.
+"""
+
+wedge_fields = ["pairs", "frequencies", "times", "data"]
+
+# number of baselines expanded and written at a time by save
+SAVE_BLOCK = 64
+
+def save(wedge, label, ptitle=""):
+    """
+    Save @wedge, titled @ptitle, to the directory <@label>.wedge/
+    Redundant groups are expanded SAVE_BLOCK baselines at a time,
+    straight into the memory-mapped file.
+    """
+    target = create(label, wedge.all_pairs, wedge.frequencies,
+                    wedge.times, ptitle)
+    for start in range(0, len(target), SAVE_BLOCK):
+        rows = slice(start, start + SAVE_BLOCK)
+        target.data[rows] = wedge.expanded_rows(rows)
+    target.data.flush()
+
+def create(label, pairs, frequencies, times, ptitle=""):
+    """
+    Create the directory <@label>.wedge/ for a wedge of zeros
+    and return that wedge, whose data are memory-mapped
+    read-write, so that it can be filled without ever being
+    held in memory in full.
+    """
+    path = label + ".wedge/"
+    os.makedirs(path, exist_ok=True)
+    axes = {'pairs' : np.asarray(pairs, dtype=int).reshape(-1, 2),
+            'frequencies' : np.asarray(frequencies),
+            'times' : np.asarray(times)}
+    for name in wedge_fields[:-1]:
+        np.save(path + name + ".npy", axes[name], allow_pickle=False)
+    set_title(label, ptitle)
+
+    data = np.lib.format.open_memmap(
+        path + "data.npy", mode='w+', dtype=np.complex128,
+        shape=(len(axes['pairs']), len(axes['frequencies']),
+               len(axes['times']), 4))
+    return Wedge(data=data, **axes)
+
+def set_title(label, ptitle):
+    """
+    Set the title of the wedge saved under @label.
+    """
+    np.save(label + ".wedge/title.npy", np.array(ptitle),
+            allow_pickle=False)
+
+def load(label, mmap_mode=None):
+    """
+    Return the wedge saved to the directory <@label>.wedge/
+    and its title. With @mmap_mode ('r', 'r+', ...; see np.load)
+    the visibilities are memory-mapped rather than read.
+    """
+    path = label + ".wedge/"
+    arrays = {name: np.load(path + name + ".npy", allow_pickle=False)
+              for name in wedge_fields[:-1]}
+    data = np.load(path + "data.npy", mmap_mode=mmap_mode,
+                   allow_pickle=False)
+    ptitle = str(np.load(path + "title.npy", allow_pickle=False))
+    return Wedge(data=data, **arrays), ptitle
+
+def saved(label):
+    """
+    Return True if a wedge has been saved under @label (see save).
+    """
+    return os.path.isdir(label + ".wedge")
@@ -0,0 +1,55 @@
+import collections
+
+import numpy as np
+import pytest
+
+from skyflux import stokes
+from skyflux import rot
+from skyflux import vis
+
+def _fake_spline_beam_func(nu, alt, az):
+    """ A smooth, frequency-dependent stand-in for the RIMEz beam. """
+    alt = np.asarray(alt, dtype=float)
+    az = np.asarray(az, dtype=float)
+    J = np.zeros(alt.shape + (2, 2), dtype=np.complex128)
+    J[..., 0, 0] = np.cos(alt) * nu / 1e8
+    J[..., 0, 1] = np.sin(az) + 1j * alt
+    J[..., 1, 0] = 0.3 * np.cos(az)
+    J[..., 1, 1] = 1j * np.sin(alt) * nu / 2e8
+    return J
+
+@pytest.fixture
+def fake_beam(monkeypatch):
+    """
+    Replace the spline beam parameters and RIMEz with stand-ins,
+    so that beam evaluations run without the 1 GB parameter file.
+    Forked worker processes inherit the replacement.
+    """
+    n_nu = 201
+    params = [np.arange(50e6, 250e6 + 1, 1e6), None, None, None, None,
+              np.zeros((n_nu, 1)), np.zeros((n_nu, 1))]
+    monkeypatch.setattr(stokes, "_sbf_params", params)
+    monkeypatch.setattr(stokes, "_construct",
+                        lambda params: _fake_spline_beam_func)
+    monkeypatch.setattr(stokes, "_spline_beam_func", None)
+    monkeypatch.setattr(stokes, "_beam_channels", None)
+    monkeypatch.setattr(stokes, "_channel_beam_funcs",
+                        collections.OrderedDict())
+    monkeypatch.setattr(vis, "_spectral_tensors",
+                        collections.OrderedDict())
+    monkeypatch.setattr(rot, "_geometry_cache", collections.OrderedDict())
+
+@pytest.fixture
+def small_cold_patch(fake_beam, monkeypatch, tmp_path):
+    """
+    Run the cold patch simulations over a few frequencies and LSTs,
+    with their backup files going to a temporary directory.
+    """
+    from skyflux.simulations import cold_tensor
+
+    def cold_axes():
+        return np.arange(100e6, 104e6 + 1, 1e6), \
+            np.linspace(0, 2 * np.pi / 3, 6)
+    monkeypatch.setattr(cold_tensor, "cold_axes", cold_axes)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
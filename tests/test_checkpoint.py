@@ -0,0 +1,74 @@
+import os
+
+import numpy as np
+import pytest
+
+from skyflux import checkpoint
+from skyflux.simulations import cold_tensor as ct
+
+def test_resume(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    params = {'axis' : np.arange(3), 'label' : "run"}
+
+    ckpt = checkpoint.Checkpoint(path, params, interval=2)
+    state = ckpt.resume(np.zeros(3))
+    for name in ("a", "b", "c"):
+        state = state + 1
+        ckpt.update(state, name)
+
+    # only the first two sources reached the disk
+    resumed = checkpoint.Checkpoint(path, dict(params))
+    assert np.array_equal(resumed.resume(np.zeros(3)), np.full(3, 2.))
+    assert resumed.done == {"a", "b"}
+    assert not os.path.exists(path + ".tmp")
+
+def test_mismatched_parameters(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    checkpoint.Checkpoint(path, {'axis' : np.arange(3)}).save(0)
+    with pytest.raises(ValueError):
+        checkpoint.Checkpoint(path, {'axis' : np.arange(4)}).resume(0)
+
+def test_finish(tmp_path):
+    path = str(tmp_path / "run.ckpt")
+    ckpt = checkpoint.Checkpoint(path, {})
+    ckpt.update(1, "a")
+    ckpt.finish(1, remove=False)
+    assert checkpoint.Checkpoint(path, {}).resume(0) == 1
+
+    output = tmp_path / "out.npz"
+    output.write_bytes(b"result")
+    checkpoint.sync(str(output))
+    ckpt.finish(1)
+    assert not os.path.exists(path)
+    checkpoint.discard(path)
+
+def test_cold_tensor_resume(small_cold_patch, monkeypatch):
+    ct.cold_tensor("whole", 84, 85, end_index=7, save_interval=2)
+    whole = ct.load_saves("backup_whole.npz")['vt']
+
+    # die while working on the sixth source
+    A_tensor = ct.A_tensor
+    calls = []
+    def counted_A_tensor(ra, dec):
+        calls.append(None)
+        if fail_at and len(calls) == fail_at:
+            raise RuntimeError("simulated crash")
+        return A_tensor(ra, dec)
+    monkeypatch.setattr(ct, "A_tensor", counted_A_tensor)
+
+    fail_at = 6
+    with pytest.raises(RuntimeError):
+        ct.cold_tensor("crash", 84, 85, end_index=7, save_interval=2)
+    assert os.path.exists("backup_crash.ckpt")
+    assert not os.path.exists("backup_crash.npz")
+
+    # the rerun computes only the sources after the last checkpoint
+    fail_at = None
+    del calls[:]
+    ct.cold_tensor("crash", 84, 85, end_index=7, save_interval=2)
+    resumed = ct.load_saves("backup_crash.npz")['vt']
+
+    assert len(calls) == 3
+
+    assert np.allclose(resumed, whole)
+    assert not os.path.exists("backup_crash.ckpt")
@@ -0,0 +1,17 @@
+import numpy as np
+
+from skyflux.simulations import cold_tensor as ct
+
+def test_parallel_matches_serial(small_cold_patch):
+    ct.cold_tensor("serial", 84, 85, start_index=0, end_index=6)
+    serial = ct.load_saves("backup_serial.npz")
+
+    nu_axis, t_axis, v_tensor = ct.parallel_cold_tensor(
+        "parallel", 84, 85, start_index=0, end_index=6, processes=2)
+    parallel = ct.load_saves("backup_parallel.npz")
+
+    assert np.array_equal(parallel['na'], serial['na'])
+    assert np.array_equal(parallel['ta'], serial['ta'])
+    assert np.allclose(parallel['vt'], serial['vt'])
+    assert np.array_equal(parallel['vt'], v_tensor)
+    assert np.any(v_tensor != 0)
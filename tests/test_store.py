@@ -0,0 +1,128 @@
+import os
+
+import numpy as np
+import pytest
+
+from skyflux import ant
+from skyflux import catalog
+from skyflux import store
+from skyflux import wedge
+from skyflux.simulations import generate_wedge as gw
+
+@pytest.fixture(params=[".h5", ".zarr"])
+def extension(request):
+    """ Run the test once per store format whose library is installed. """
+    pytest.importorskip({".h5" : "h5py", ".zarr" : "zarr"}[request.param])
+    return request.param
+
+@pytest.fixture
+def small_layout(monkeypatch):
+    """ Shrink the layout to a handful of its antennas. """
+    positions = ant.get_ant_pos()
+    monkeypatch.setattr(ant, "_ant_pos",
+                        {ID: positions[ID] for ID in sorted(positions)[:8]})
+    monkeypatch.setattr(ant, "_array", None)
+
+def random_wedge(seed, pairs=((84, 85), (85, 86), (86, 87))):
+    rng = np.random.default_rng(seed)
+    shape = (len(pairs), 3, 5, 4)
+    return wedge.Wedge(pairs, np.array([1e8, 1.5e8, 2e8]),
+                       np.linspace(0, 1, 5),
+                       rng.normal(size=shape) + 1j * rng.normal(size=shape))
+
+def test_round_trip(extension, tmp_path):
+    path = str(tmp_path / ("run" + extension))
+    block = random_wedge(0)
+    store.save_wedge(block, path, "title", sources=[3, 1], note=7)
+
+    loaded, title = store.load_wedge(path)
+    assert title == "title"
+    assert np.array_equal(loaded.pairs, block.pairs)
+    assert np.array_equal(loaded.frequencies, block.frequencies)
+    assert np.array_equal(loaded.times, block.times)
+    assert np.array_equal(loaded.data, block.data)
+
+    with store.open_store(path, "r+") as source:
+        assert list(source.sources) == [3, 1]
+        assert source.metadata["note"] == 7
+        assert np.array_equal(source.baseline(85, 86), block.data[1])
+        assert np.array_equal(source.lst_slice(2), block.data[:, :, 2:3])
+
+        source.append_times([2.], np.ones((3, 3, 1, 4)))
+        source.title = "retitled"
+
+    with store.open_store(path) as source:
+        assert source.title == "retitled"
+        assert np.array_equal(source.times, np.append(block.times, 2.))
+        assert np.array_equal(source.visibilities[:, :, -1],
+                              np.ones((3, 3, 4)))
+
+def test_redundant_round_trip(extension, small_layout, tmp_path):
+    path = str(tmp_path / ("run" + extension))
+    all_pairs = ant.array.pairs()
+    unique_pairs, group, conjugated = ant.array.redundancy()
+    rng = np.random.default_rng(1)
+    shape = (len(unique_pairs), 2, 2, 4)
+    block = wedge.Wedge(unique_pairs, [1e8, 2e8], [0, 1],
+                        rng.normal(size=shape) + 1j * rng.normal(size=shape),
+                        redundancy=(all_pairs, group, conjugated))
+
+    store.save_wedge(block, path)
+    loaded, _ = store.load_wedge(path)
+    assert np.array_equal(loaded.pairs, all_pairs)
+    assert np.array_equal(loaded.data, block.expand().data)
+
+@pytest.mark.parametrize("coherent", [False, True])
+def test_merge(extension, tmp_path, coherent):
+    paths = [str(tmp_path / (name + extension)) for name in "abc"]
+    blocks = [random_wedge(0), random_wedge(1)]
+    store.save_wedge(blocks[0], paths[0], "a", sources=[1, 2])
+    store.save_wedge(blocks[1], paths[1], "b", sources=[5])
+
+    expected = gw.merge_wedges(blocks[0], blocks[1], coherent).data
+
+    gw.merge_files(paths[0], paths[1], paths[2], "c", coherent)
+    merged, title = store.load_wedge(paths[2])
+    assert title == "c"
+    assert np.allclose(merged.data, expected)
+    with store.open_store(paths[2]) as source:
+        assert sorted(source.sources) == [1, 2, 5]
+
+    # an output that overwrites an input absorbs the other input
+    gw.merge_files(paths[0], paths[1], paths[1], "d", coherent)
+    merged, title = store.load_wedge(paths[1])
+    assert title == "d"
+    assert np.allclose(merged.data, expected)
+
+def test_merge_incompatible(extension, tmp_path):
+    paths = [str(tmp_path / (name + extension)) for name in "abc"]
+    store.save_wedge(random_wedge(0), paths[0], "a")
+    store.save_wedge(random_wedge(1, pairs=((84, 85),)), paths[1], "b")
+
+    with pytest.raises(ValueError):
+        gw.merge_files(paths[0], paths[1], paths[2], "c")
+    assert not os.path.exists(paths[2])
+
+    with pytest.raises(ValueError):
+        gw.merge_files(paths[0], paths[1], paths[0], "c")
+    assert store.load_wedge(paths[0])[1] == "a"
+
+@pytest.mark.parametrize("count", [1, 3])
+@pytest.mark.parametrize("coherent", [False, True])
+def test_full_wedge_output(extension, small_layout, fake_beam,
+                           monkeypatch, tmp_path, count, coherent):
+    monkeypatch.setattr(gw, "nu_axis", np.array([1.5e8, 1.51e8]))
+    monkeypatch.setattr(gw, "t_axis", np.array([0.1, 0.2]))
+    sources = catalog.srcs[catalog.query(valid_alpha=True)[:count]]
+
+    path = str(tmp_path / ("run" + extension))
+    with store.create(path, ant.array.pairs(),
+                      gw.nu_axis, gw.t_axis) as out:
+        block = gw.full_wedge(sources, save_interval=2,
+                              coherent=coherent, out=out)
+
+    loaded, _ = store.load_wedge(path)
+    assert np.allclose(loaded.data, block.expand().data)
+    if count == 1:
+        # a lone source is saved as is, phases and all
+        assert np.any(np.iscomplex(loaded.data))
@@ -0,0 +1,67 @@
+import numpy as np
+
+from skyflux import ant
+from skyflux import wedge
+
+def grid_array():
+    """ A 3 x 2 grid of antennas, 14.6 m apart. """
+    return ant.AntennaArray({ID: np.array([14.6 * (ID % 3),
+                                           14.6 * (ID // 3), 0.])
+                             for ID in range(6)})
+
+def redundant_wedge(seed=0):
+    """
+    A compressed wedge over grid_array: one random row
+    per redundant group, standing in for every baseline.
+    """
+    array = grid_array()
+    all_pairs = array.pairs()
+    unique_pairs, group, conjugated = array.redundancy(all_pairs)
+
+    rng = np.random.default_rng(seed)
+    shape = (len(unique_pairs), 8, 3, 4)
+    data = rng.normal(size=shape) + 1j * rng.normal(size=shape)
+    return wedge.Wedge(unique_pairs, np.linspace(1e8, 2e8, 8),
+                       np.linspace(0, 1, 3), data,
+                       redundancy=(all_pairs, group, conjugated))
+
+def test_redundancy_groups():
+    compressed = redundant_wedge()
+    all_pairs, group, conjugated = compressed.redundancy
+    assert len(compressed.pairs) < len(all_pairs)
+
+    array = grid_array()
+    b = array.baselines(all_pairs)[:, 0:2]
+    b[conjugated] *= -1
+    representative = array.baselines(compressed.pairs)[:, 0:2]
+    assert np.allclose(b, representative[group])
+
+def test_expand():
+    compressed = redundant_wedge()
+    full = compressed.expand()
+    assert full.redundancy is None
+    assert np.array_equal(full.pairs, compressed.all_pairs)
+
+    _, group, conjugated = compressed.redundancy
+    for b, (ID1, ID2) in enumerate(full.pairs.tolist()):
+        expected = compressed.data[group[b]]
+        if conjugated[b]:
+            expected = np.conj(expected)
+        assert np.array_equal(full.data[b], expected)
+        assert np.array_equal(compressed.baseline(ID1, ID2), expected)
+
+def test_transform_redundant():
+    compressed = redundant_wedge()
+    window = np.hanning(len(compressed.frequencies))
+
+    transformed = compressed.transform(window)
+    expected = compressed.expand().transform(window)
+    assert transformed.redundancy is None
+    assert np.array_equal(transformed.pairs, expected.pairs)
+    assert np.allclose(transformed.data, expected.data)
+
+def test_package_round_trip():
+    compressed = redundant_wedge()
+    restored = wedge.unpackage(wedge.package(compressed, "title"))
+    assert np.array_equal(restored.pairs, compressed.all_pairs)
+    assert np.array_equal(restored.data, compressed.expand().data)